@@ -31,9 +31,10 @@ except Exception:
     pass
 
 # If DATABASE_URL env var exists, set it into config
+# (driver psycopg 3 như data/db_postgresql.py: postgresql:// mặc định là psycopg2, không còn cài)
 db_url = os.getenv('DATABASE_URL')
 if db_url:
-    config.set_main_option('sqlalchemy.url', db_url)
+    config.set_main_option('sqlalchemy.url', db_url.replace('postgresql://', 'postgresql+psycopg://', 1))
 
 # Import your metadata object here
 # for 'autogenerate' support
@@ -1,9 +1,9 @@
 # app/api/main.py
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Query
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Optional, List
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, raiseload
 import os
 import re
 from functools import lru_cache
@@ -31,7 +31,7 @@ try:
         remove_from_watchlist,
         add_watch_history
     )
-    from app.data.models import User, Movie, Rating, Review, WatchHistory, Watchlist
+    from app.data.models import User, Movie, Rating, Review, WatchHistory
     USE_POSTGRESQL = True
     print("✅ Using PostgreSQL for user data")
 except Exception as e:
@@ -687,12 +687,14 @@ def create_interaction(request: InteractionRequest):
         action = request.action.lower()
         if action == 'view':
             movie_controller.record_view(request.movieId, user)
+            recommendation_controller.invalidate_user_behavior(user)
         elif action == 'click':
             movie_controller.record_click(request.movieId, user)
         elif action == 'rating':
             if request.rating is None:
                 raise HTTPException(status_code=400, detail="rating required for action=rating")
             movie_controller.record_rating(request.movieId, user, request.rating)
+            recommendation_controller.invalidate_user_behavior(user)
         elif action in ('like', 'dislike'):
             movie_controller.add_interaction(request.movieId, user, action)
         else:
@@ -811,11 +813,11 @@ def get_comments_counts_get(movie_ids: str, db: Session = Depends(get_db)):
         
         # Count reviews per movie
         counts_query = db.query(
-            Review.movie_id,
+            Movie.movie_id,
             func.count(Review.id).label('count')
-        ).filter(
-            Review.movie_id.in_([str(mid) for mid in ids])
-        ).group_by(Review.movie_id).all()
+        ).join(Review.movie).filter(
+            Movie.movie_id.in_([str(mid) for mid in ids])
+        ).group_by(Movie.movie_id).all()
         
         counts = {int(movie_id): count for movie_id, count in counts_query}
         return {"counts": counts}
@@ -838,11 +840,11 @@ def get_comments_counts_post(body: dict, db: Session = Depends(get_db)):
         
         # Count reviews per movie
         counts_query = db.query(
-            Review.movie_id,
+            Movie.movie_id,
             func.count(Review.id).label('count')
-        ).filter(
-            Review.movie_id.in_([str(mid) for mid in ids])
-        ).group_by(Review.movie_id).all()
+        ).join(Review.movie).filter(
+            Movie.movie_id.in_([str(mid) for mid in ids])
+        ).group_by(Movie.movie_id).all()
         
         counts = {int(movie_id): count for movie_id, count in counts_query}
         return {"counts": counts}
@@ -968,7 +970,7 @@ class WatchHistoryRequest(BaseModel):
 
 
 @app.post("/watch-history")
-async def add_watch_history_new(request: WatchHistoryRequest, db: Session = Depends(get_db)):
+def add_watch_history_new(request: WatchHistoryRequest, db: Session = Depends(get_db)):
     """Ghi lại lịch sử xem phim."""
     try:
         user_id = (request.user_id or "").strip()
@@ -987,6 +989,7 @@ async def add_watch_history_new(request: WatchHistoryRequest, db: Session = Depe
         get_or_create_user(db, user_id=user_id)
         
         add_watch_history(db, user_id, movie_id)
+        recommendation_controller.invalidate_user_behavior(user_id)
         
         return {"status": "ok", "movie_id": movie_id, "user_id": user_id}
     except HTTPException:
@@ -1245,10 +1248,10 @@ def get_user_behavior_analysis(user_id: str):
 
 
 @app.post("/models/refresh")
-def refresh_recommendation_models():
-    """Cập nhật models với dữ liệu mới (để học liên tục)."""
+def refresh_recommendation_models(user_ids: Optional[List[str]] = Query(None)):
+    """Cập nhật models với dữ liệu mới (để học liên tục); user_ids: chỉ cập nhật các user này."""
     try:
-        success = recommendation_controller.refresh_models()
+        success = recommendation_controller.refresh_models(user_ids)
         return {"status": "ok" if success else "failed"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -1274,7 +1277,8 @@ def get_user_stats(user_id: str, db: Session = Depends(get_db)):
         ratings = pg_get_ratings(db, user_id)
         watchlist_items = pg_get_watchlist(db, user_id)
         watch_history = pg_get_history(db, user_id)
-        reviews = db.query(Review).filter(Review.user_id == user_id).all()
+        # Only counted: never lazy-load their relationships
+        reviews = db.query(Review).filter(Review.user_pk == user.id).options(raiseload('*')).all()
         
         # Calculate additional stats
         completed_movies = [h for h in watch_history if h.completed]
@@ -1410,14 +1414,8 @@ def toggle_watchlist(user_id: str, movie_id: int, db: Session = Depends(get_db))
         
         movie_id_str = str(movie_id)
         
-        # Check if exists
-        existing = db.query(Watchlist).filter(
-            Watchlist.user_id == user_id,
-            Watchlist.movie_id == movie_id_str
-        ).first()
-        
-        if existing:
-            remove_from_watchlist(db, user_id, movie_id_str)
+        # Delete first: a hit means it was in the watchlist, no separate lookup needed
+        if remove_from_watchlist(db, user_id, movie_id_str):
             return {"action": "removed", "in_watchlist": False}
         else:
             add_to_watchlist(db, user_id, movie_id_str)
@@ -1446,6 +1444,7 @@ def update_watch_progress(
         
         movie_id_str = str(movie_id)
         add_watch_history(db, user_id, movie_id_str, progress, completed)
+        recommendation_controller.invalidate_user_behavior(user_id)
         return {"success": True, "progress": progress, "completed": completed}
     
     except Exception as e:
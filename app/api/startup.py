@@ -7,7 +7,7 @@ from fastapi import FastAPI
 from contextlib import asynccontextmanager
 
 # Import PostgreSQL database functions
-from data.db_postgresql import init_db, close_db, engine
+from data.db_postgresql import init_db, close_db, close_async_db, engine
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -47,6 +47,7 @@ async def lifespan(app: FastAPI):
     try:
         print("📊 Closing PostgreSQL connections...")
         close_db()
+        await close_async_db()
         print("✅ PostgreSQL connections closed")
     except Exception as e:
         print(f"⚠️  Error closing database: {e}")
@@ -2,13 +2,25 @@ from app.models.collaborative_model import CollaborativeModel
 from app.models.content_based_model import ContentBasedModel
 from app.models.hybrid_model import HybridModel
 from app.models.personalized_model import PersonalizedRecommendationModel
+from app.models import _kernels
 
 class RecommendationController:
     def __init__(self, data_dir=None):
         self.collaborative_model = CollaborativeModel(data_dir)
         self.content_based_model = ContentBasedModel(data_dir)
-        self.hybrid_model = HybridModel(data_dir)
-        self.personalized_model = PersonalizedRecommendationModel(data_dir)
+        # Hybrid & personalized dùng chung một bộ collaborative/content-based models
+        self.hybrid_model = HybridModel(
+            data_dir,
+            collaborative_model=self.collaborative_model,
+            content_based_model=self.content_based_model
+        )
+        self.personalized_model = PersonalizedRecommendationModel(
+            data_dir,
+            collaborative_model=self.collaborative_model,
+            content_based_model=self.content_based_model
+        )
+        # Compile numeric kernels now so the first request doesn't pay for it
+        _kernels.warmup()
     
     def get_collaborative_recommendations(self, user_id=None, n_recommendations=10):
         return self.collaborative_model.get_recommendations(user_id, n_recommendations)
@@ -27,8 +39,17 @@ class RecommendationController:
         """Phân tích hành vi người dùng."""
         return self.personalized_model.analyze_user_behavior(user_id)
     
-    def refresh_models(self):
-        """Cập nhật tất cả models với dữ liệu mới."""
-        self.collaborative_model.refresh()
-        self.personalized_model.refresh()
+    def invalidate_user_behavior(self, user_id):
+        """Bỏ behavior đã cache của user sau khi họ xem / đánh giá phim."""
+        self.personalized_model.invalidate_behavior(user_id)
+    
+    def refresh_models(self, user_ids=None):
+        """Cập nhật tất cả models với dữ liệu mới (user_ids: chỉ các user có rating thay đổi)."""
+        # personalized_model.refresh() chỉ refresh collaborative model dùng chung này
+        self.collaborative_model.refresh(dirty_user_ids=user_ids)
+        if user_ids:
+            for user_id in user_ids:
+                self.personalized_model.invalidate_behavior(user_id)
+        else:
+            self.personalized_model.invalidate_behavior()
         return True
@@ -0,0 +1,50 @@
+# app/data/bulk.py
+"""
+Bulk insert helpers cho các bảng ghi nhiều (UserEvent)
+Dùng Core insert() + executemany thay vì session.add() từng row:
+SQLAlchemy gộp các row thành INSERT ... VALUES (...), (...) theo trang
+(insertmanyvalues_page_size của engine)
+"""
+import uuid
+from datetime import datetime
+from typing import Dict, List
+
+from sqlalchemy.orm import Session
+
+from .models import UserEvent
+
+_EVENT_COLUMNS = [c.key for c in UserEvent.__table__.columns if c.key != 'id']
+
+
+def _event_row(event: Dict) -> Dict:
+    """Chuẩn hóa 1 event dict: đủ mọi cột (executemany cần cùng tập key) + default"""
+    row = {key: event.get(key) for key in _EVENT_COLUMNS}
+    timestamp = row['timestamp'] or datetime.utcnow()
+    row['timestamp'] = timestamp
+    row['event_id'] = row['event_id'] or str(uuid.uuid4())
+    if row['hour_of_day'] is None:
+        row['hour_of_day'] = timestamp.hour
+    if row['day_of_week'] is None:
+        row['day_of_week'] = timestamp.weekday()
+    if row['processed'] is None:
+        row['processed'] = False
+    return row
+
+
+def bulk_insert_events(session: Session, events: List[Dict]) -> int:
+    """
+    Insert nhiều UserEvent trong 1 executemany (không tạo ORM object)
+    Caller tự commit. Trả về số event đã insert.
+    """
+    if not events:
+        return 0
+    
+    rows = [_event_row(event) for event in events]
+    
+    if session.get_bind().dialect.name == 'postgresql':
+        session.execute(UserEvent.__table__.insert(), rows)
+    else:
+        # Dialect không hỗ trợ insertmanyvalues tốt: để ORM tự batch
+        session.bulk_insert_mappings(UserEvent, rows)
+    
+    return len(rows)
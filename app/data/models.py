@@ -1,21 +1,106 @@
 # app/data/models.py
-from sqlalchemy import Column, Integer, String, Float, Text, DateTime, ForeignKey, JSON, Boolean, Index
+from sqlalchemy import Column, Integer, SmallInteger, String, Float, Text, DateTime, ForeignKey, Boolean, Index, UniqueConstraint
+from sqlalchemy.types import TypeDecorator
+from sqlalchemy.dialects.postgresql import JSONB, JSON
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
+from sqlalchemy.ext.associationproxy import association_proxy
+from sqlalchemy.sql import func, select
 from datetime import datetime
+import enum
+
+try:
+    from pgvector.sqlalchemy import Vector
+    PGVECTOR_AVAILABLE = True
+except ImportError:
+    PGVECTOR_AVAILABLE = False
 
 Base = declarative_base()
 
+# Kích thước user_embedding (pgvector vector(128))
+USER_EMBEDDING_DIM = 128
+
+# Timestamps are generated by PostgreSQL (naive UTC, same as datetime.utcnow)
+# instead of being computed in Python and sent with every INSERT/UPDATE
+utc_now = func.timezone('utc', func.now())
+
+
+# Các cột categorical ít giá trị lưu dưới dạng SMALLINT (2 bytes) thay vì VARCHAR.
+# OTHER = 0 dành cho giá trị cũ không nhận ra lúc migrate.
+class EventType(enum.IntEnum):
+    OTHER = 0
+    VIEW = 1
+    CLICK = 2
+    SCROLL = 3
+    HOVER = 4
+    SEARCH = 5
+    RATING = 6
+    ADD_WATCHLIST = 7
+    REMOVE_WATCHLIST = 8
+    PLAY = 9
+    PAUSE = 10
+    COMPLETE = 11
+    RECOMMENDATION_SHOWN = 12
+
+class EventCategory(enum.IntEnum):
+    OTHER = 0
+    IMPLICIT = 1
+    EXPLICIT = 2
+
+class FeedbackType(enum.IntEnum):
+    OTHER = 0
+    CLICK = 1
+    WATCH = 2
+    SKIP = 3
+    HIDE = 4
+    LIKE = 5
+    DISLIKE = 6
+    COMPLETE = 7
+
+class ModelType(enum.IntEnum):
+    OTHER = 0
+    COLLABORATIVE = 1
+    CONTENT = 2
+    HYBRID = 3
+    PERSONALIZED = 4
+
+class IntEnumCode(TypeDecorator):
+    """
+    SMALLINT trong DB, string ở ORM: 'view' <-> EventType.VIEW (1).
+    Code ứng dụng vẫn dùng string như cũ (filter, insert, đọc).
+    """
+    impl = SmallInteger
+    cache_ok = True
+    
+    def __init__(self, enum_class):
+        super().__init__()
+        self.enum_class = enum_class
+    
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, self.enum_class):
+            return int(value)
+        try:
+            return int(self.enum_class[value.upper()])
+        except KeyError:
+            raise ValueError(f"Unknown {self.enum_class.__name__}: {value!r}") from None
+    
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return self.enum_class(value).name.lower()
+
 class User(Base):
     __tablename__ = 'users'
     
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     user_id = Column(String(255), unique=True, nullable=False, index=True)
     name = Column(String(255))
     email = Column(String(255), unique=True, index=True)
     password_hash = Column(String(255), nullable=True)  # Hashed password for authentication
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime, server_default=utc_now)
+    updated_at = Column(DateTime, server_default=utc_now, onupdate=utc_now)
     
     # Relationships
     ratings = relationship("Rating", back_populates="user", cascade="all, delete-orphan")
@@ -26,15 +111,15 @@ class User(Base):
 class Movie(Base):
     __tablename__ = 'movies'
     
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     movie_id = Column(String(50), unique=True, nullable=False, index=True)
     title = Column(String(500), nullable=False, index=True)
     original_title = Column(String(500))
     overview = Column(Text)
     tagline = Column(String(500))
-    genres = Column(JSON)  # Store as JSON array
+    genres = Column(JSONB)  # Store as JSON array
     keywords = Column(Text)
-    cast_data = Column(JSON)  # Store cast as JSON
+    cast_data = Column(JSONB)  # Store cast as JSON
     director = Column(String(255))
     
     # Media
@@ -45,7 +130,7 @@ class Movie(Base):
     
     # Metadata
     release_date = Column(String(50))
-    year = Column(Integer, index=True)
+    year = Column(Integer)  # idx_movie_year_rating
     runtime = Column(Integer)
     budget = Column(Float)
     revenue = Column(Float)
@@ -53,15 +138,15 @@ class Movie(Base):
     # Ratings
     vote_average = Column(Float, index=True)
     vote_count = Column(Integer)
-    popularity = Column(Float, index=True)
+    popularity = Column(Float)  # idx_movie_popularity
     
     # Status
     status = Column(String(50))
     original_language = Column(String(10))
     
     # Timestamps
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime, server_default=utc_now)
+    updated_at = Column(DateTime, server_default=utc_now, onupdate=utc_now)
     
     # Relationships
     ratings = relationship("Rating", back_populates="movie", cascade="all, delete-orphan")
@@ -73,52 +158,79 @@ class Movie(Base):
     __table_args__ = (
         Index('idx_movie_year_rating', 'year', 'vote_average'),
         Index('idx_movie_popularity', 'popularity'),
+        Index('idx_movie_genres_gin', 'genres', postgresql_using='gin'),
     )
 
-class Rating(Base):
+def user_pk(user_id):
+    """users.id of an external user_id, as a scalar subquery"""
+    return select(User.id).where(User.user_id == user_id).scalar_subquery()
+
+def movie_pk(movie_id):
+    """movies.id of an external movie_id, as a scalar subquery"""
+    return select(Movie.id).where(Movie.movie_id == movie_id).scalar_subquery()
+
+class ExternalIdsMixin:
+    """
+    Rows reference users/movies by integer primary key (user_pk, movie_pk):
+    index entries and joins stay small. The external string ids remain
+    readable/filterable as `user_id`/`movie_id` and can still be passed
+    to the constructor (resolved inside the INSERT)
+    """
+    user_id = association_proxy('user', 'user_id')
+    movie_id = association_proxy('movie', 'movie_id')
+
+    def __init__(self, user_id=None, movie_id=None, **kwargs):
+        if user_id is not None:
+            kwargs.setdefault('user_pk', user_pk(user_id))
+        if movie_id is not None:
+            kwargs.setdefault('movie_pk', movie_pk(movie_id))
+        super().__init__(**kwargs)
+
+class Rating(ExternalIdsMixin, Base):
     __tablename__ = 'ratings'
     
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(String(255), ForeignKey('users.user_id'), nullable=False, index=True)
-    movie_id = Column(String(50), ForeignKey('movies.movie_id'), nullable=False, index=True)
+    id = Column(Integer, primary_key=True)
+    user_pk = Column(Integer, ForeignKey('users.id'), nullable=False)
+    movie_pk = Column(Integer, ForeignKey('movies.id'), nullable=False, index=True)
     rating = Column(Float, nullable=False)
-    timestamp = Column(DateTime, default=datetime.utcnow, index=True)
+    timestamp = Column(DateTime, server_default=utc_now)
     
     # Relationships
     user = relationship("User", back_populates="ratings")
     movie = relationship("Movie", back_populates="ratings")
     
     __table_args__ = (
-        Index('idx_user_movie_rating', 'user_id', 'movie_id'),
+        Index('idx_user_movie_rating', 'user_pk', 'movie_pk'),
+        Index('idx_rating_timestamp_brin', 'timestamp', postgresql_using='brin', postgresql_with={'pages_per_range': 32}),
     )
 
-class Review(Base):
+class Review(ExternalIdsMixin, Base):
     __tablename__ = 'reviews'
     
-    id = Column(Integer, primary_key=True, index=True)
-    movie_id = Column(String(50), ForeignKey('movies.movie_id'), nullable=False, index=True)
-    user_id = Column(String(255), ForeignKey('users.user_id'), nullable=False, index=True)
+    id = Column(Integer, primary_key=True)
+    movie_pk = Column(Integer, ForeignKey('movies.id'), nullable=False)
+    user_pk = Column(Integer, ForeignKey('users.id'), nullable=False, index=True)
     username = Column(String(255))
     rating = Column(Integer, nullable=False)
     review_text = Column(Text)
     helpful_count = Column(Integer, default=0)
-    timestamp = Column(DateTime, default=datetime.utcnow, index=True)
+    timestamp = Column(DateTime, server_default=utc_now, index=True)
     
     # Relationships
     user = relationship("User", back_populates="reviews")
     movie = relationship("Movie", back_populates="reviews")
     
     __table_args__ = (
-        Index('idx_movie_timestamp', 'movie_id', 'timestamp'),
+        Index('idx_movie_timestamp', 'movie_pk', 'timestamp'),
     )
 
-class WatchHistory(Base):
+class WatchHistory(ExternalIdsMixin, Base):
     __tablename__ = 'watch_history'
     
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(String(255), ForeignKey('users.user_id'), nullable=False, index=True)
-    movie_id = Column(String(50), ForeignKey('movies.movie_id'), nullable=False, index=True)
-    watched_at = Column(DateTime, default=datetime.utcnow, index=True)
+    id = Column(Integer, primary_key=True)
+    user_pk = Column(Integer, ForeignKey('users.id'), nullable=False)
+    movie_pk = Column(Integer, ForeignKey('movies.id'), nullable=False, index=True)
+    watched_at = Column(DateTime, server_default=utc_now)
     progress = Column(Float, default=0.0)  # Watch progress percentage
     completed = Column(Boolean, default=False)
     
@@ -127,23 +239,27 @@ class WatchHistory(Base):
     movie = relationship("Movie", back_populates="watch_history")
     
     __table_args__ = (
-        Index('idx_user_watched', 'user_id', 'watched_at'),
+        # Covering: watch history mới nhất của user (ORDER BY watched_at DESC = quét ngược index) + movie_pk,
+        # đọc chỉ từ index (index-only scan)
+        Index('idx_user_watched_covering', 'user_pk', 'watched_at', postgresql_include=['movie_pk']),
+        Index('idx_watch_history_watched_brin', 'watched_at', postgresql_using='brin', postgresql_with={'pages_per_range': 32}),
     )
 
-class Watchlist(Base):
+class Watchlist(ExternalIdsMixin, Base):
     __tablename__ = 'watchlist'
     
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(String(255), ForeignKey('users.user_id'), nullable=False, index=True)
-    movie_id = Column(String(50), ForeignKey('movies.movie_id'), nullable=False, index=True)
-    added_at = Column(DateTime, default=datetime.utcnow, index=True)
+    id = Column(Integer, primary_key=True)
+    user_pk = Column(Integer, ForeignKey('users.id'), nullable=False)
+    movie_pk = Column(Integer, ForeignKey('movies.id'), nullable=False, index=True)
+    added_at = Column(DateTime, server_default=utc_now, index=True)
     
     # Relationships
     user = relationship("User", back_populates="watchlist")
     movie = relationship("Movie", back_populates="watchlist")
     
+    # Unique so add_to_watchlist can use INSERT ... ON CONFLICT DO NOTHING
     __table_args__ = (
-        Index('idx_user_movie_watchlist', 'user_id', 'movie_id'),
+        UniqueConstraint('user_pk', 'movie_pk', name='idx_user_movie_watchlist'),
     )
 
 
@@ -156,29 +272,31 @@ class UserEvent(Base):
     """
     __tablename__ = 'user_events'
     
-    id = Column(Integer, primary_key=True, index=True)
-    event_id = Column(String(100), unique=True, nullable=False, index=True)  # UUID
+    # Partitioned by month on timestamp: PK/unique keys must include the partition key
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    event_id = Column(String(100), nullable=False, index=True)  # UUID
     
     # Core fields
-    user_id = Column(String(255), nullable=False, index=True)
-    session_id = Column(String(100), index=True)
-    movie_id = Column(String(50), index=True)
+    user_id = Column(String(255), nullable=False)  # idx_user_timestamp
+    session_id = Column(String(100))  # idx_session
+    movie_id = Column(String(50))  # idx_movie_event
     
     # Event type and metadata
-    event_type = Column(String(50), nullable=False, index=True)  # view, click, play, pause, rating, search, etc.
-    event_category = Column(String(20), index=True)  # implicit, explicit
+    event_type = Column(IntEnumCode(EventType), nullable=False)  # idx_event_type_timestamp; view, click, play, pause, rating, search, etc.
+    event_category = Column(IntEnumCode(EventCategory), index=True)  # implicit, explicit
     event_value = Column(Float)  # rating value, watch_time, etc.
-    event_metadata = Column(JSON)  # Additional context
+    event_metadata = Column(JSONB)  # Additional context
     
     # Context information
     device = Column(String(50))  # mobile, desktop, tablet
     platform = Column(String(50))  # web, android, ios
     user_agent = Column(Text)
     ip_address = Column(String(50))
-    geo_location = Column(JSON)  # {country, city, ...}
+    geo_location = Column(JSONB)  # {country, city, ...}
     
     # Temporal context
-    timestamp = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+    # Giữ phía Python (partition key, cần giá trị chính xác lúc event xảy ra); bulk insert vẫn gửi theo batch
+    timestamp = Column(DateTime, default=datetime.utcnow, primary_key=True)
     hour_of_day = Column(Integer)  # 0-23
     day_of_week = Column(Integer)  # 0-6
     
@@ -196,6 +314,12 @@ class UserEvent(Base):
         Index('idx_event_type_timestamp', 'event_type', 'timestamp'),
         Index('idx_movie_event', 'movie_id', 'event_type', 'timestamp'),
         Index('idx_session', 'session_id', 'timestamp'),
+        # Bảng append-only theo thời gian: BRIN nhỏ hơn B-tree rất nhiều cho range scan
+        Index('idx_event_timestamp_brin', 'timestamp', postgresql_using='brin', postgresql_with={'pages_per_range': 32}),
+        UniqueConstraint('event_id', 'timestamp', name='uq_event_id_timestamp'),
+        # Partition theo tháng (user_events_YYYYMM, xem USER_EVENT_PARTITIONS_SQL):
+        # query gần đây chỉ chạm partition hiện tại, index nhỏ theo từng partition
+        {'postgresql_partition_by': 'RANGE (timestamp)'},
     )
 
 
@@ -205,13 +329,13 @@ class UserProfile(Base):
     """
     __tablename__ = 'user_profiles'
     
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(String(255), unique=True, nullable=False, index=True)
+    id = Column(Integer, primary_key=True)
+    user_id = Column(String(255), nullable=False)  # unique: idx_profile_user_covering
     
     # Preference vectors
-    genre_preferences = Column(JSON)  # {genre: score}
-    actor_preferences = Column(JSON)  # {actor: score}
-    director_preferences = Column(JSON)  # {director: score}
+    genre_preferences = Column(JSONB)  # {genre: score}
+    actor_preferences = Column(JSONB)  # {actor: score}
+    director_preferences = Column(JSONB)  # {director: score}
     
     # Behavioral patterns
     avg_rating = Column(Float)
@@ -220,29 +344,45 @@ class UserProfile(Base):
     avg_watch_time = Column(Float)  # minutes
     
     # Temporal patterns
-    preferred_watch_hours = Column(JSON)  # {hour: count}
-    preferred_watch_days = Column(JSON)  # {day: count}
+    preferred_watch_hours = Column(JSONB)  # {hour: count}
+    preferred_watch_days = Column(JSONB)  # {day: count}
     
     # Engagement metrics
     active_days = Column(Integer, default=0)
     last_active = Column(DateTime)
-    first_seen = Column(DateTime, default=datetime.utcnow)
+    first_seen = Column(DateTime, server_default=utc_now)
     
     # Diversity & exploration
     genre_diversity = Column(Float)  # Shannon entropy
     exploration_rate = Column(Float)  # % new genres tried
     
     # Computed features for ML
-    user_embedding = Column(JSON)  # Vector representation
+    # pgvector: lưu float4 native + HNSW index cho nearest-neighbor (fallback JSONB nếu chưa cài)
+    user_embedding = Column(Vector(USER_EMBEDDING_DIM) if PGVECTOR_AVAILABLE else JSONB)
     cluster_id = Column(Integer)  # User clustering
     
+    # analyze_user_behavior tính sẵn (favorite_genres, genre_weights, preferred_decade, ...)
+    # JSON (không phải JSONB): giữ nguyên thứ tự key của genre_weights (most_common), không query bên trong
+    behavior = Column(JSON)
+    behavior_updated_at = Column(DateTime)
+    
     # Metadata
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = Column(DateTime, server_default=utc_now, onupdate=utc_now)
     version = Column(Integer, default=1)
     
     __table_args__ = (
         Index('idx_cluster', 'cluster_id'),
         Index('idx_last_active', 'last_active'),
+        Index('idx_profile_genres_gin', 'genre_preferences', postgresql_using='gin'),
+        # Covering: đọc genre_preferences/cluster_id theo user_id chỉ từ index
+        Index('idx_profile_user_covering', 'user_id', unique=True,
+              postgresql_include=['genre_preferences', 'cluster_id']),
+        *([Index(
+            'idx_user_embedding_hnsw', 'user_embedding',
+            postgresql_using='hnsw',
+            postgresql_with={'m': 16, 'ef_construction': 64},
+            postgresql_ops={'user_embedding': 'vector_cosine_ops'},
+        )] if PGVECTOR_AVAILABLE else []),
     )
 
 
@@ -252,26 +392,30 @@ class RecommendationCache(Base):
     """
     __tablename__ = 'recommendation_cache'
     
-    id = Column(Integer, primary_key=True, index=True)
-    cache_key = Column(String(255), unique=True, nullable=False, index=True)
+    id = Column(Integer, primary_key=True)
+    cache_key = Column(String(255), nullable=False)  # unique: idx_cache_covering
     
-    user_id = Column(String(255), index=True)
-    context = Column(JSON)  # {device, time, page, ...}
+    user_id = Column(String(255))  # idx_user_model
+    context = Column(JSONB)  # {device, time, page, ...}
     
     # Recommendation data
-    model_type = Column(String(50), nullable=False)  # collaborative, content, hybrid
+    model_type = Column(IntEnumCode(ModelType), nullable=False)  # collaborative, content, hybrid
     model_version = Column(String(50))
-    recommendations = Column(JSON, nullable=False)  # [{movie_id, score, reason}, ...]
+    recommendations = Column(JSONB, nullable=False)  # [{movie_id, score, reason}, ...]
     
     # Metadata
-    created_at = Column(DateTime, default=datetime.utcnow, index=True)
-    expires_at = Column(DateTime, index=True)
+    created_at = Column(DateTime, server_default=utc_now, index=True)
+    expires_at = Column(DateTime)  # idx_expires
     hit_count = Column(Integer, default=0)
     last_accessed = Column(DateTime)
     
     __table_args__ = (
         Index('idx_user_model', 'user_id', 'model_type'),
         Index('idx_expires', 'expires_at'),
+        # Covering: kiểm tra hết hạn / model_version ngay trên index.
+        # recommendations (JSONB) không INCLUDE: có thể vượt giới hạn kích thước tuple của btree
+        Index('idx_cache_covering', 'cache_key', unique=True,
+              postgresql_include=['expires_at', 'model_version']),
     )
 
 
@@ -281,29 +425,30 @@ class RecommendationFeedback(Base):
     """
     __tablename__ = 'recommendation_feedback'
     
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     feedback_id = Column(String(100), unique=True, nullable=False)
     
-    user_id = Column(String(255), nullable=False, index=True)
+    user_id = Column(String(255), nullable=False)  # idx_user_movie_feedback
     movie_id = Column(String(50), nullable=False, index=True)
-    recommendation_id = Column(String(100), index=True)  # Link to source recommendation
+    recommendation_id = Column(String(100))  # idx_recommendation; Link to source recommendation
     
     # Feedback type
-    feedback_type = Column(String(50), nullable=False)  # click, watch, skip, hide, like, dislike
+    feedback_type = Column(IntEnumCode(FeedbackType), nullable=False)  # click, watch, skip, hide, like, dislike
     feedback_value = Column(Float)  # 1 for positive, -1 for negative, 0 for neutral
     
     # Context
     position = Column(Integer)  # Position in recommendation list
-    model_type = Column(String(50))
+    model_type = Column(IntEnumCode(ModelType))
     model_version = Column(String(50))
     
     # Timing
-    timestamp = Column(DateTime, default=datetime.utcnow, index=True)
+    timestamp = Column(DateTime, server_default=utc_now)
     time_to_action = Column(Integer)  # seconds from show to action
     
     __table_args__ = (
         Index('idx_user_movie_feedback', 'user_id', 'movie_id', 'timestamp'),
         Index('idx_recommendation', 'recommendation_id'),
+        Index('idx_feedback_timestamp_brin', 'timestamp', postgresql_using='brin', postgresql_with={'pages_per_range': 32}),
     )
 
 
@@ -313,9 +458,9 @@ class ModelPerformance(Base):
     """
     __tablename__ = 'model_performance'
     
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     
-    model_type = Column(String(50), nullable=False, index=True)
+    model_type = Column(IntEnumCode(ModelType), nullable=False)  # idx_model_date
     model_version = Column(String(50), nullable=False, index=True)
     
     # Offline metrics
@@ -339,7 +484,7 @@ class ModelPerformance(Base):
     retention_impact = Column(Float)
     
     # Metadata
-    evaluation_date = Column(DateTime, default=datetime.utcnow, index=True)
+    evaluation_date = Column(DateTime, server_default=utc_now, index=True)
     sample_size = Column(Integer)
     test_set_size = Column(Integer)
     
@@ -356,7 +501,7 @@ class ABTest(Base):
     """
     __tablename__ = 'ab_tests'
     
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     test_id = Column(String(100), unique=True, nullable=False, index=True)
     
     test_name = Column(String(255), nullable=False)
@@ -373,13 +518,13 @@ class ABTest(Base):
     end_date = Column(DateTime, index=True)
     
     # Results
-    control_metrics = Column(JSON)
-    treatment_metrics = Column(JSON)
+    control_metrics = Column(JSONB)
+    treatment_metrics = Column(JSONB)
     statistical_significance = Column(Float)
     winner = Column(String(50))
     
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime, server_default=utc_now)
+    updated_at = Column(DateTime, server_default=utc_now, onupdate=utc_now)
     
     __table_args__ = (
         Index('idx_status_dates', 'status', 'start_date', 'end_date'),
@@ -392,7 +537,7 @@ class UserConsent(Base):
     """
     __tablename__ = 'user_consents'
     
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     user_id = Column(String(255), unique=True, nullable=False, index=True)
     
     # Consent flags
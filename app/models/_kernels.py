@@ -0,0 +1,218 @@
+"""
+Numeric kernels dùng chung cho các recommendation models.
+Compile bằng numba nếu có cài đặt, nếu không thì fallback về NumPy.
+"""
+import numpy as np
+
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+
+if NUMBA_AVAILABLE:
+    @njit(cache=True)
+    def _topk_heap(scores, k):
+        """
+        Single pass over `scores` keeping a size-k min-heap (ties keep the lower index).
+        Heap order: lower score first, equal scores by higher index first, so the root is
+        always the entry a later (higher-index) equal score must not displace.
+        """
+        heap_val = np.empty(k, dtype=np.float32)
+        heap_idx = np.empty(k, dtype=np.int64)
+        size = 0
+        for i in range(scores.shape[0]):
+            v = scores[i]
+            if size < k:
+                # Sift up
+                pos = size
+                size += 1
+                while pos > 0:
+                    parent = (pos - 1) // 2
+                    if heap_val[parent] < v:
+                        break
+                    heap_val[pos] = heap_val[parent]
+                    heap_idx[pos] = heap_idx[parent]
+                    pos = parent
+                heap_val[pos] = v
+                heap_idx[pos] = i
+            elif v > heap_val[0]:
+                # Replace root and sift down
+                pos = 0
+                while True:
+                    child = 2 * pos + 1
+                    if child >= k:
+                        break
+                    if child + 1 < k and (heap_val[child + 1] < heap_val[child] or (
+                            heap_val[child + 1] == heap_val[child] and heap_idx[child + 1] > heap_idx[child])):
+                        child += 1
+                    if heap_val[child] >= v:
+                        break
+                    heap_val[pos] = heap_val[child]
+                    heap_idx[pos] = heap_idx[child]
+                    pos = child
+                heap_val[pos] = v
+                heap_idx[pos] = i
+
+        # Insertion sort the k survivors: score desc, index asc
+        for i in range(1, k):
+            v = heap_val[i]
+            idx = heap_idx[i]
+            j = i - 1
+            while j >= 0 and (heap_val[j] < v or (heap_val[j] == v and heap_idx[j] > idx)):
+                heap_val[j + 1] = heap_val[j]
+                heap_idx[j + 1] = heap_idx[j]
+                j -= 1
+            heap_val[j + 1] = v
+            heap_idx[j + 1] = idx
+        return heap_idx
+
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _cf_scores_csc(indptr, indices, data, sim, denom, out):
+        """out[j] = sum_u sim[u] * R[u, j] / denom, one movie (CSC column) per thread"""
+        for j in prange(out.shape[0]):
+            s = np.float32(0.0)
+            for k in range(indptr[j], indptr[j + 1]):
+                s += sim[indices[k]] * data[k]
+            out[j] = s / denom
+
+    @njit(cache=True)
+    def _context_scores_kernel(fav_match, fav_weights, recent_match, tod_match,
+                               ratings, years, preferred_decade, out):
+        """Điểm ngữ cảnh cho từng phim ứng viên (xem context_scores)"""
+        for i in range(out.shape[0]):
+            score = 0.0
+            match_count = 0
+            for j in range(fav_match.shape[1]):
+                if fav_match[i, j]:
+                    match_count += 1
+                    score += 0.15 * min(fav_weights[j] / 5, 1.0)
+            if match_count >= 2:
+                score += 0.2
+            elif match_count >= 1:
+                score += 0.1
+            if recent_match[i]:
+                score += 0.15
+            if tod_match[i]:
+                score += 0.1
+            rating = ratings[i]
+            if rating >= 8.0:
+                score += 0.15
+            elif rating >= 7.0:
+                score += 0.1
+            elif rating >= 6.0:
+                score += 0.05
+            year = years[i]
+            if preferred_decade != 0 and year != 0 and not np.isnan(year):
+                if abs((year // 10) * 10 - preferred_decade) <= 10:
+                    score += 0.1
+            out[i] = score
+
+
+def topk_scores(scores, k):
+    """
+    Trả về index của k phần tử có score cao nhất, sắp xếp giảm dần.
+    NaN được coi là thấp nhất. Không sort toàn bộ mảng.
+    """
+    scores = np.asarray(scores, dtype=np.float32)
+    k = min(int(k), scores.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    scores = np.where(np.isnan(scores), np.float32(-np.inf), scores)
+
+    if NUMBA_AVAILABLE:
+        return _topk_heap(scores, k)
+
+    if k < scores.shape[0]:
+        # Mọi phần tử lớn hơn ngưỡng thứ k, rồi các phần tử bằng ngưỡng theo index tăng dần
+        # (argpartition chọn tùy ý giữa các giá trị bằng nhau ở biên)
+        kth = -np.partition(-scores, k - 1)[k - 1]
+        above = np.flatnonzero(scores > kth)
+        idx = np.concatenate([above, np.flatnonzero(scores == kth)[:k - len(above)]])
+    else:
+        idx = np.arange(scores.shape[0])
+    # lexsort: last key is primary -> score desc, then index asc
+    order = np.lexsort((idx, -scores[idx]))
+    return idx[order].astype(np.int64)
+
+
+def cf_scores(R_csc, similarities, denom):
+    """
+    Điểm dự đoán user-user CF cho mọi phim: (R.T @ similarities) / denom.
+    R_csc là ma trận rating user x movie dạng CSC (cột = phim).
+    """
+    similarities = np.asarray(similarities, dtype=np.float32)
+    if not NUMBA_AVAILABLE:
+        return (R_csc.T @ similarities) / np.float32(denom)
+    out = np.empty(R_csc.shape[1], dtype=np.float32)
+    _cf_scores_csc(R_csc.indptr, R_csc.indices, R_csc.data.astype(np.float32, copy=False),
+                   similarities, np.float32(denom), out)
+    return out
+
+
+def context_scores(fav_match, fav_weights, recent_match, tod_match, ratings, years, preferred_decade):
+    """
+    Điểm context-aware cho n phim ứng viên:
+    - fav_match (n x F bool): phim khớp thể loại yêu thích j, mỗi lần khớp +0.15 * min(weight / 5, 1),
+      thêm +0.2 nếu khớp >= 2 thể loại, +0.1 nếu khớp 1
+    - recent_match / tod_match (n bool): khớp thể loại xem gần đây (+0.15) / khung giờ (+0.1)
+    - ratings: vote_average >= 8 / 7 / 6 -> +0.15 / 0.1 / 0.05
+    - years: cách preferred_decade không quá 10 năm -> +0.1 (0 hoặc NaN = không có năm)
+    """
+    fav_match = np.asarray(fav_match, dtype=np.bool_)
+    fav_weights = np.asarray(fav_weights, dtype=np.float64)
+    recent_match = np.asarray(recent_match, dtype=np.bool_)
+    tod_match = np.asarray(tod_match, dtype=np.bool_)
+    ratings = np.asarray(ratings, dtype=np.float64)
+    years = np.asarray(years, dtype=np.float64)
+    preferred_decade = float(preferred_decade or 0)
+    
+    if NUMBA_AVAILABLE:
+        out = np.empty(len(ratings), dtype=np.float64)
+        _context_scores_kernel(fav_match, fav_weights, recent_match, tod_match,
+                               ratings, years, preferred_decade, out)
+        return out
+    
+    match_count = fav_match.sum(axis=1)
+    score = fav_match @ (0.15 * np.minimum(fav_weights / 5, 1.0))
+    score += np.where(match_count >= 2, 0.2, np.where(match_count >= 1, 0.1, 0.0))
+    score += np.where(recent_match, 0.15, 0.0) + np.where(tod_match, 0.1, 0.0)
+    with np.errstate(invalid='ignore'):
+        score += np.select([ratings >= 8.0, ratings >= 7.0, ratings >= 6.0], [0.15, 0.1, 0.05], 0.0)
+        if preferred_decade:
+            has_year = (years != 0) & ~np.isnan(years)
+            score += np.where(has_year & (np.abs((years // 10) * 10 - preferred_decade) <= 10), 0.1, 0.0)
+    return score
+
+
+def update_similarity_rows(similarity, Rn, rows):
+    """
+    Cập nhật cosine similarity (U x U, đối xứng) chỉ cho các hàng `rows` có rating thay đổi:
+    hàng/cột đó = Rn[rows] @ Rn.T, phần còn lại giữ nguyên. Rn: các hàng đã chuẩn hóa L2.
+    """
+    from scipy import sparse
+    n = Rn.shape[0]
+    rows = np.unique(np.asarray(rows, dtype=np.int64))
+    # P: d x U chọn các hàng dirty; D: U x U giữ lại các hàng/cột không đổi
+    P = sparse.csr_matrix((np.ones(len(rows), dtype=similarity.dtype), (np.arange(len(rows)), rows)), shape=(len(rows), n))
+    keep = np.ones(n, dtype=similarity.dtype)
+    keep[rows] = 0
+    D = sparse.diags(keep)
+    updated = (Rn[rows] @ Rn.T).astype(similarity.dtype)  # d x U
+    placed = P.T @ updated  # hàng dirty
+    # Khối dirty x dirty có mặt ở cả hàng lẫn cột: trừ đi một lần
+    overlap = P.T @ (updated @ P.T) @ P
+    result = D @ similarity @ D + placed + placed.T - overlap
+    result.eliminate_zeros()
+    return result.tocsr()
+
+
+def warmup():
+    """Compile kernels ahead of the first request (no-op without numba)."""
+    topk_scores(np.zeros(1, dtype=np.float32), 1)
+    if NUMBA_AVAILABLE:
+        from scipy import sparse
+        cf_scores(sparse.csc_matrix(np.ones((1, 1), dtype=np.float32)), np.ones(1, dtype=np.float32), 1.0)
+        context_scores(np.zeros((1, 1), dtype=np.bool_), np.ones(1), np.zeros(1, dtype=np.bool_),
+                       np.zeros(1, dtype=np.bool_), np.zeros(1), np.zeros(1), 0)
@@ -2,20 +2,56 @@ import pandas as pd
 import numpy as np
 import sys
 import os
-from sklearn.metrics.pairwise import cosine_similarity
+import glob
+import hashlib
+from scipy import sparse
+from sklearn.preprocessing import normalize
 import time
+import threading
+from collections import OrderedDict
+from datetime import timedelta
 
 # Thêm thư mục gốc vào PYTHONPATH
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 
-from app.models.movie_model import MovieModel
+from app.models.movie_model import MovieModel, db_postgresql
+from app.models._kernels import topk_scores, cf_scores, update_similarity_rows
+
+# Top-N precomputed per user in RecommendationCache (cache_key = collab:<user_id>)
+RECOMMENDATION_CACHE_TTL = timedelta(hours=6)
+PRECOMPUTE_N = 50
+CACHE_RETRY_SECONDS = 60
+# Kết quả get_recommendations giữ trong bộ nhớ (LRU, hết hạn sau TTL hoặc khi model build lại)
+RESULT_CACHE_SIZE = 1024
+RESULT_CACHE_TTL = 60
+# Số phim phổ biến (vote_average cao nhất) giữ sẵn cho user chưa có rating
+POPULAR_POOL_SIZE = 200
 
 class CollaborativeModel:
     def __init__(self, data_dir=None):
         # Use MovieModel as the source of truth for movie & ratings data
         self.movie_model = MovieModel(data_dir=data_dir)
-        self.ratings_matrix = None
+        # Sparse user x movie ratings (CSR) + row/column labels
+        self.R = None
+        self.R_csc = None  # Same matrix by column (movie) for the scoring kernel
+        self.Rn = None  # R with rows scaled to unit L2 norm (cosine = dot product)
+        self.user_ids = None
+        self.movie_ids = None
         self.user_similarity = None
+        # {movie_id: frozenset thể loại (lowercase)}, tính một lần mỗi lần build
+        self._movie_genres = {}
+        # Top POPULAR_POOL_SIZE phim theo vote_average, sort một lần mỗi lần build
+        self._popular_movies = None
+        # movie_ids có metadata trong movies_df (bool theo cột của R)
+        self._movie_has_metadata = None
+        # Hash of the ratings the model was built from (see _ratings_version)
+        self.model_version = None
+        self._cache_retry_at = 0
+        # (user_id, n, _last_build_time) -> {"data": [...], "timestamp": ...}
+        self._result_cache = OrderedDict()
+        self._result_cache_lock = threading.Lock()
+        # user_id -> (_last_build_time, frozenset thể loại của phim user đánh giá >= 4)
+        self._preferred_genres_cache = {}
         self._last_build_time = 0
         self._build_cache_duration = 600  # Rebuild model only every 10 minutes
         # build model initially; allow refresh later to pick up new ratings
@@ -29,8 +65,7 @@ class CollaborativeModel:
         current_time = time.time()
         
         # Skip rebuild if model was built recently (within cache duration)
-        if (self.ratings_matrix is not None and 
-            not self.ratings_matrix.empty and
+        if (not self._is_empty() and
             current_time - self._last_build_time < self._build_cache_duration):
             return
         
@@ -44,28 +79,128 @@ class CollaborativeModel:
 
             # Create user x movie ratings matrix
             if ratings_df.empty:
-                self.ratings_matrix = pd.DataFrame()
-                self.user_similarity = np.array([])
+                self._reset()
                 return
 
-            self.ratings_matrix = ratings_df.pivot(
-                index='userId',
-                columns='movieId',
-                values='rating'
-            ).fillna(0)
+            # One rating per (user, movie): keep the latest row
+            ratings_df = ratings_df.dropna(subset=['userId', 'movieId'])
+            ratings_df = ratings_df.drop_duplicates(['userId', 'movieId'], keep='last')
+
+            # Sparse CSR từ mã categorical (categories đã sort, giống pivot)
+            users = pd.Categorical(ratings_df['userId'])
+            movies = pd.Categorical(ratings_df['movieId'])
+            self.user_ids = pd.Index(users.categories)
+            self.movie_ids = pd.Index(movies.categories)
+            self.R = sparse.csr_matrix(
+                (ratings_df['rating'].fillna(0).to_numpy(np.float32), (users.codes, movies.codes)),
+                shape=(len(self.user_ids), len(self.movie_ids))
+            )
+            self.R_csc = self.R.tocsc()
+            self.Rn = normalize(self.R, norm='l2', axis=1)
+            self._movie_genres = self._build_movie_genres()
+            self._popular_movies = self._build_popular_movies()
+            movies_df = self.movie_model.movies_df
+            self._movie_has_metadata = (
+                self.movie_ids.isin(movies_df['id']) if 'id' in movies_df.columns
+                else np.zeros(len(self.movie_ids), dtype=bool)
+            )
 
-            # Compute user similarity
-            self.user_similarity = cosine_similarity(self.ratings_matrix)
+            # Compute user similarity (sparse x sparse, zeros are skipped),
+            # reusing the artifact saved for the same ratings if there is one
+            self.model_version = self._ratings_version(ratings_df)
+            cache_path = self._similarity_cache_path(self.model_version)
+            self.user_similarity = self._load_similarity(cache_path)
+            if self.user_similarity is None:
+                # Hàng đã chuẩn hóa một lần: cosine = một phép nhân Rn @ Rn.T
+                self.user_similarity = (self.Rn @ self.Rn.T).tocsr()
+                self._save_similarity(cache_path)
             self._last_build_time = current_time
-            print(f"✓ Collaborative model built/refreshed (users: {len(self.ratings_matrix)}, movies: {len(self.ratings_matrix.columns)})")
+            print(f"✓ Collaborative model built/refreshed (users: {len(self.user_ids)}, movies: {len(self.movie_ids)})")
 
         except Exception as e:
             print(f"Error building collaborative model: {str(e)}")
-            self.ratings_matrix = pd.DataFrame()
-            self.user_similarity = np.array([])
+            self._reset()
+
+    def _reset(self):
+        """Empty model (no ratings available)"""
+        self.R = sparse.csr_matrix((0, 0), dtype=np.float32)
+        self.R_csc = self.R.tocsc()
+        self.Rn = self.R
+        self.user_ids = pd.Index([])
+        self.movie_ids = pd.Index([])
+        self.user_similarity = sparse.csr_matrix((0, 0), dtype=np.float32)
+        self._movie_genres = {}
+        self._popular_movies = None
+        self._movie_has_metadata = np.zeros(0, dtype=bool)
+        self.model_version = None
+
+    def _build_movie_genres(self):
+        movies_df = self.movie_model.movies_df
+        if 'id' not in movies_df.columns or 'genres' not in movies_df.columns:
+            return {}
+        movie_genres = {}
+        for movie_id, genres in zip(movies_df['id'], movies_df['genres']):
+            if movie_id not in movie_genres:
+                movie_genres[movie_id] = frozenset(
+                    g.strip() for g in str(genres).lower().split('|') if g.strip()
+                )
+        return movie_genres
+
+    def _build_popular_movies(self):
+        movies_df = self.movie_model.movies_df
+        if 'vote_average' not in movies_df.columns:
+            return None
+        return movies_df.sort_values('vote_average', ascending=False).head(POPULAR_POOL_SIZE)
+
+    def _is_empty(self):
+        return self.R is None or self.R.shape[0] == 0
+
+    def _ratings_version(self, ratings_df):
+        """hash(số dòng + timestamp mới nhất) - đổi khi có rating mới"""
+        latest = ratings_df['timestamp'].max() if 'timestamp' in ratings_df.columns else ''
+        return hashlib.md5(f"{len(ratings_df)}-{latest}".encode()).hexdigest()
+
+    def _similarity_cache_path(self, version):
+        """collab_<version>.npz"""
+        return os.path.join(self.movie_model.data_dir, f'collab_{version}.npz')
+
+    def _load_similarity(self, path):
+        if not os.path.exists(path):
+            return None
+        try:
+            similarity = sparse.load_npz(path).tocsr()
+        except Exception as e:
+            print(f"Could not load similarity cache {path}: {e}")
+            return None
+        n_users = self.R.shape[0]
+        return similarity if similarity.shape == (n_users, n_users) else None
+
+    def _save_similarity(self, path):
+        """Persist user_similarity and drop artifacts of older ratings"""
+        try:
+            sparse.save_npz(path, self.user_similarity)
+            for stale in glob.glob(os.path.join(os.path.dirname(path), 'collab_*.npz')):
+                if stale != path:
+                    os.remove(stale)
+        except Exception as e:
+            print(f"Could not save similarity cache {path}: {e}")
 
-    def refresh(self):
-        """Reload ratings from MovieModel and rebuild matrices."""
+    def refresh(self, dirty_user_ids=None):
+        """
+        Reload ratings from MovieModel and rebuild matrices.
+        dirty_user_ids: chỉ các user này có rating thay đổi -> cập nhật riêng hàng/cột
+        similarity của họ thay vì tính lại toàn bộ U x U (fallback: rebuild đầy đủ)
+        """
+        with self._result_cache_lock:
+            self._result_cache.clear()
+        self._preferred_genres_cache.clear()
+        if dirty_user_ids is not None and not self._is_empty():
+            try:
+                if self._refresh_users(dirty_user_ids):
+                    return True
+            except Exception as e:
+                print(f"Incremental refresh failed, rebuilding: {e}")
+        
         # reload ratings_df from the source (which may read from DB)
         try:
             # Force a rebuild by resetting the cache timer
@@ -88,44 +223,106 @@ class CollaborativeModel:
         except Exception:
             return False
     
+    def _refresh_users(self, user_ids):
+        """
+        Đọc lại rating của user_ids từ DB, thay các hàng tương ứng trong R/Rn và
+        similarity. Trả về False nếu phải rebuild toàn bộ (user/phim mới, không đọc được DB).
+        """
+        user_ids = set(user_ids)
+        if not user_ids:
+            return True
+        fresh = self.movie_model._fetch_ratings_from_db(user_ids)
+        if fresh.empty:
+            # Không phân biệt được "không còn rating" với lỗi DB
+            return False
+        fresh = fresh.dropna(subset=['userId', 'movieId']).drop_duplicates(['userId', 'movieId'], keep='last')
+        
+        user_codes = self.user_ids.get_indexer(fresh['userId'])
+        movie_codes = self.movie_ids.get_indexer(fresh['movieId'])
+        if (user_codes < 0).any() or (movie_codes < 0).any():
+            return False
+        
+        ratings_df = self.movie_model.ratings_df
+        ratings_df = pd.concat([ratings_df[~ratings_df['userId'].isin(user_ids)], fresh], ignore_index=True)
+        
+        # Thay hàng của các user dirty trong R (giữ nguyên chỉ số user/phim)
+        dirty_rows = self.user_ids.get_indexer(list(user_ids))
+        dirty_rows = dirty_rows[dirty_rows >= 0]
+        keep = np.ones(self.R.shape[0], dtype=np.float32)
+        keep[dirty_rows] = 0
+        new_rows = sparse.csr_matrix(
+            (fresh['rating'].fillna(0).to_numpy(np.float32), (user_codes, movie_codes)),
+            shape=self.R.shape
+        )
+        self.R = (sparse.diags(keep) @ self.R + new_rows).tocsr()
+        self.R.eliminate_zeros()
+        self.R_csc = self.R.tocsc()
+        self.Rn = normalize(self.R, norm='l2', axis=1)
+        self.user_similarity = update_similarity_rows(self.user_similarity, self.Rn, dirty_rows)
+        
+        self.movie_model.ratings_df = ratings_df
+        self.model_version = self._ratings_version(ratings_df)
+        self._save_similarity(self._similarity_cache_path(self.model_version))
+        self._last_build_time = time.time()
+        print(f"✓ Collaborative model updated for {len(dirty_rows)} users")
+        return True
+    
     def get_recommendations(self, user_id=None, n_recommendations=10):
         """
         Lấy gợi ý phim dựa trên Collaborative Filtering với personalization
+        Top-N của user được đọc từ RecommendationCache khi còn hạn
+        (ghi bởi precompute_user_recommendations hoặc lần tính trước)
         """
         # Ensure model is up-to-date with latest ratings
-        if self.ratings_matrix is None or (hasattr(self, 'ratings_matrix') and getattr(self, 'ratings_matrix', pd.DataFrame()).empty):
+        if self._is_empty():
             # Attempt refresh
             self.refresh()
 
-        if self.ratings_matrix is None or self.ratings_matrix.empty:
+        if self._is_empty():
             return []
         
+        cache_key = (user_id, n_recommendations, self._last_build_time)
+        with self._result_cache_lock:
+            cached_entry = self._result_cache.get(cache_key)
+            if cached_entry is not None and time.time() - cached_entry["timestamp"] < RESULT_CACHE_TTL:
+                self._result_cache.move_to_end(cache_key)
+                return [dict(movie) for movie in cached_entry["data"]]
+        
+        results = self._recommend(user_id, n_recommendations)
+        # Build time có thể đã đổi (refresh bên trong _recommend)
+        with self._result_cache_lock:
+            self._result_cache[(user_id, n_recommendations, self._last_build_time)] = {
+                "data": [dict(movie) for movie in results],
+                "timestamp": time.time()
+            }
+            while len(self._result_cache) > RESULT_CACHE_SIZE:
+                self._result_cache.popitem(last=False)
+        return results
+    
+    def _recommend(self, user_id, n_recommendations):
+        if user_id is not None:
+            cached = self._load_cached_scores(user_id)
+            if cached is not None and len(cached) >= n_recommendations:
+                return self._with_movie_info(cached[:n_recommendations])
+        
         # Try to enrich with user behavioral data from PostgreSQL
-        user_watched_movies = set()
-        if user_id:
-            try:
-                try:
-                    from app.data import database as _db
-                except Exception:
-                    from data import database as _db
-                # Get user's watch history to exclude from recommendations
-                watch_history = _db.fetch_watch_history(user_id, limit=100, data_dir=self.movie_model.data_dir)
-                user_watched_movies = {entry.get('movieId') for entry in watch_history if entry.get('movieId')}
-            except Exception as e:
-                print(f"Could not fetch watch history for {user_id}: {e}")
+        user_watched_movies = self._watched_movies(user_id) if user_id else set()
             
         if user_id is None:
             # Nếu không có user_id, lấy người dùng có nhiều đánh giá nhất
-            user_id = self.ratings_matrix.sum(axis=1).idxmax()
+            user_id = self.user_ids[np.asarray(self.R.sum(axis=1)).ravel().argmax()]
         else:
             # user_id may be numeric or string; ensure it exists in index
-            if user_id not in self.ratings_matrix.index:
+            if user_id not in self.user_ids:
                 # Attempt to refresh once and check again
                 self.refresh()
-                if user_id not in self.ratings_matrix.index:
+                if user_id not in self.user_ids:
                     # User has no ratings yet - return popular movies they haven't watched
-                    all_movies = self.movie_model.movies_df
-                    popular_movies = all_movies.sort_values('vote_average', ascending=False).head(n_recommendations * 2)
+                    if self._popular_movies is not None and n_recommendations * 2 <= POPULAR_POOL_SIZE:
+                        popular_movies = self._popular_movies.head(n_recommendations * 2)
+                    else:
+                        all_movies = self.movie_model.movies_df
+                        popular_movies = all_movies.sort_values('vote_average', ascending=False).head(n_recommendations * 2)
                     
                     # Exclude watched movies
                     if user_watched_movies:
@@ -140,71 +337,169 @@ class CollaborativeModel:
                             movie_dict['id'] = movie_dict['movieId']
                         results.append(movie_dict)
                     return results
+            
+            # Cache miss: tính đủ PRECOMPUTE_N phim (như precompute) để request nhỏ hơn không ghi đè
+            # danh sách dài bằng danh sách ngắn, trả về n_recommendations phim đầu
+            scored = self._score_user(user_id, user_watched_movies, max(n_recommendations, PRECOMPUTE_N))
+            self._save_cached_scores(user_id, scored)
+            return self._with_movie_info(scored[:n_recommendations])
         
+        return self._with_movie_info(self._score_user(user_id, user_watched_movies, n_recommendations))
+    
+    def precompute_user_recommendations(self, user_ids=None, n_recommendations=PRECOMPUTE_N):
+        """
+        Tính sẵn top-N cho các user (mặc định: mọi user có rating) và ghi vào
+        RecommendationCache, để request chỉ còn một SELECT theo cache_key
+        Returns: số user đã ghi cache
+        """
+        self._build_model()
+        if self._is_empty():
+            return 0
+        
+        count = 0
+        for user_id in (self.user_ids if user_ids is None else user_ids):
+            if user_id not in self.user_ids:
+                continue
+            scored = self._score_user(user_id, self._watched_movies(user_id), n_recommendations)
+            if self._save_cached_scores(user_id, scored):
+                count += 1
+        return count
+    
+    def _watched_movies(self, user_id):
+        """Phim user đã xem (để loại khỏi gợi ý)"""
+        try:
+            try:
+                from app.data import database as _db
+            except Exception:
+                from data import database as _db
+            # Get user's watch history to exclude from recommendations
+            watch_history = _db.fetch_watch_history(user_id, limit=100, data_dir=self.movie_model.data_dir)
+            return {entry.get('movieId') for entry in watch_history if entry.get('movieId')}
+        except Exception as e:
+            print(f"Could not fetch watch history for {user_id}: {e}")
+            return set()
+    
+    def _score_user(self, user_id, exclude_movies, n_recommendations):
+        """Top-N [(movie_id, predicted_rating)] cho một user có trong ma trận"""
         # Lấy các phim chưa được đánh giá bởi người dùng
-        user_ratings = self.ratings_matrix.loc[user_id]
-        unwatched_movies = user_ratings[user_ratings == 0].index
+        user_idx = self.user_ids.get_loc(user_id)
+        # Hàng CSR của user: chỉ các phim đã đánh giá (O(nnz) thay vì O(số phim))
+        user_row = self.R[user_idx]
+        rated_cols = user_row.indices[user_row.data != 0]
         
-        # Exclude movies from watch history to avoid repetition
-        if user_watched_movies:
-            unwatched_movies = [m for m in unwatched_movies if m not in user_watched_movies]
+        # Ứng viên = phim chưa đánh giá, chưa xem (watch history) và có metadata
+        # (phim không có metadata sẽ bị bỏ qua khi trả kết quả): một boolean mask
+        candidate_mask = self._movie_has_metadata.copy()
+        candidate_mask[rated_cols] = False
+        if exclude_movies:
+            watched_cols = self.movie_ids.get_indexer(list(exclude_movies))
+            candidate_mask[watched_cols[watched_cols >= 0]] = False
+        candidate_cols = np.flatnonzero(candidate_mask)
+        candidate_ids = self.movie_ids[candidate_cols].tolist()
         
         # Tính toán điểm dự đoán cho các phim chưa xem
-        user_idx = self.ratings_matrix.index.get_loc(user_id)
-        user_similarities = self.user_similarity[user_idx]
+        user_similarities = self.user_similarity[user_idx].toarray().ravel()
         
-        # Lấy thể loại của phim người dùng đã đánh giá cao (>= 4 sao)
-        user_high_ratings = self.ratings_matrix.loc[user_id]
-        high_rated_movies = user_high_ratings[user_high_ratings >= 4.0].index
+        # Điểm cho tất cả phim cùng lúc: (1 x U) @ (U x M), song song theo phim (numba)
+        similarity_sum = np.abs(user_similarities).sum()
+        if similarity_sum > 0:
+            scores = cf_scores(self.R_csc, user_similarities, similarity_sum)
+        else:
+            scores = np.asarray(self.R.sum(axis=0)).ravel() / self.R.shape[0]
+        pred_scores = scores[candidate_cols].astype(np.float32)
         
-        preferred_genres = set()
-        for movie_id in high_rated_movies:
-            movie_info = self.movie_model.get_movie_by_id(movie_id)
-            if movie_info:
-                genres = str(movie_info.get('genres', '')).lower().split('|')
-                for genre in genres:
-                    genre = genre.strip()
-                    if genre:
-                        preferred_genres.add(genre)
-        
-        predictions = []
-        for movie_id in unwatched_movies:
-            movie_ratings = self.ratings_matrix[movie_id]
-            # Tính điểm dự đoán dựa trên đánh giá của người dùng tương tự
-            similarity_sum = np.sum(np.abs(user_similarities))
-            if similarity_sum > 0:
-                pred_rating = np.sum(user_similarities * movie_ratings) / similarity_sum
-            else:
-                pred_rating = movie_ratings.mean()
-            predictions.append((movie_id, pred_rating))
-        
-        # Sắp xếp và lấy top N phim
-        predictions.sort(key=lambda x: x[1], reverse=True)
-        top_movies = []
+        # Lấy top N phim (không sort toàn bộ danh sách)
+        top_idx = topk_scores(pred_scores, n_recommendations * 2)
+        
+        # Metadata của các phim top: một lần lọc movies_df
+        movie_infos = self._movie_infos([candidate_ids[i] for i in top_idx])
+        
+        # Lấy thể loại của phim người dùng đã đánh giá cao
+        preferred_genres = self._preferred_genres(user_id, user_row)
         
         # Áp dụng genre filtering để đảm bảo relevance
-        for movie_id, pred_rating in predictions:
-            movie_info = self.movie_model.get_movie_by_id(movie_id)
+        top_movies = []
+        for i in top_idx:
+            movie_id, pred_rating = candidate_ids[i], pred_scores[i]
+            movie_info = movie_infos.get(movie_id)
             if movie_info:
                 # Nếu có preferred genres, ưu tiên phim khớp thể loại
                 if preferred_genres:
-                    movie_genres = str(movie_info.get('genres', '')).lower().split('|')
-                    genre_match = any(g.strip() in preferred_genres for g in movie_genres if g.strip())
-                    
                     # Boost score nếu khớp thể loại
-                    if genre_match:
-                        movie_info['predicted_rating'] = float(pred_rating * 1.15)
-                    else:
-                        movie_info['predicted_rating'] = float(pred_rating)
-                else:
-                    movie_info['predicted_rating'] = float(pred_rating)
+                    if not preferred_genres.isdisjoint(self._movie_genres.get(movie_id, ())):
+                        pred_rating = pred_rating * 1.15
                 
-                top_movies.append(movie_info)
+                top_movies.append((movie_id, float(pred_rating)))
                 
                 if len(top_movies) >= n_recommendations * 2:
                     break
         
         # Re-sort sau khi boost
-        top_movies.sort(key=lambda x: x.get('predicted_rating', 0), reverse=True)
+        top_movies.sort(key=lambda x: x[1], reverse=True)
         
-        return top_movies[:n_recommendations] 
\ No newline at end of file
+        return top_movies[:n_recommendations]
+    
+    def _preferred_genres(self, user_id, user_row):
+        """Thể loại của các phim user đánh giá >= 4 sao, cache tới lần build kế tiếp"""
+        cached = self._preferred_genres_cache.get(user_id)
+        if cached is not None and cached[0] == self._last_build_time:
+            return cached[1]
+        high_rated_movies = self.movie_ids[user_row.indices[user_row.data >= 4.0]]
+        preferred_genres = frozenset().union(
+            *(self._movie_genres.get(movie_id, ()) for movie_id in high_rated_movies)
+        )
+        self._preferred_genres_cache[user_id] = (self._last_build_time, preferred_genres)
+        return preferred_genres
+    
+    def _movie_infos(self, movie_ids):
+        """{movie_id: dict} cho nhiều phim trong một lần lọc movies_df"""
+        return {movie['id']: movie for movie in self.movie_model.get_movies_by_ids(movie_ids)}
+    
+    def _with_movie_info(self, scored):
+        """[(movie_id, predicted_rating)] -> list movie dict kèm predicted_rating"""
+        movie_infos = self._movie_infos([movie_id for movie_id, _ in scored])
+        results = []
+        for movie_id, pred_rating in scored:
+            movie_info = movie_infos.get(movie_id)
+            if movie_info:
+                results.append({**movie_info, 'predicted_rating': pred_rating})
+        return results
+    
+    def _load_cached_scores(self, user_id):
+        """Top-N đã lưu trong RecommendationCache (None nếu không có / hết hạn / model đã đổi)"""
+        if time.time() < self._cache_retry_at:
+            return None
+        try:
+            with db_postgresql.get_db_session() as db:
+                cached = db_postgresql.get_cached_recommendations(
+                    db, f"collab:{user_id}", model_version=self.model_version
+                )
+        except Exception as e:
+            self._cache_unavailable(e)
+            return None
+        if cached is None:
+            return None
+        return [(item['movie_id'], item['score']) for item in cached]
+    
+    def _save_cached_scores(self, user_id, scored):
+        if time.time() < self._cache_retry_at:
+            return False
+        recommendations = [
+            {'movie_id': movie_id.item() if hasattr(movie_id, 'item') else movie_id, 'score': score}
+            for movie_id, score in scored
+        ]
+        try:
+            with db_postgresql.get_db_session() as db:
+                db_postgresql.save_cached_recommendations(
+                    db, f"collab:{user_id}", str(user_id), 'collaborative', recommendations,
+                    model_version=self.model_version, ttl=RECOMMENDATION_CACHE_TTL
+                )
+            return True
+        except Exception as e:
+            self._cache_unavailable(e)
+            return False
+    
+    def _cache_unavailable(self, error):
+        """DB không dùng được: bỏ qua RecommendationCache một lúc thay vì thử lại mỗi request"""
+        print(f"RecommendationCache unavailable, retrying in {CACHE_RETRY_SECONDS}s: {error}")
+        self._cache_retry_at = time.time() + CACHE_RETRY_SECONDS
@@ -3,13 +3,55 @@ import numpy as np
 import sys
 import os
 import json
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+import re
+from sklearn.feature_extraction import FeatureHasher
+from sklearn.feature_extraction.text import (
+    TfidfVectorizer, HashingVectorizer, TfidfTransformer, ENGLISH_STOP_WORDS
+)
+from sklearn.preprocessing import normalize
+from sklearn.decomposition import TruncatedSVD
+from scipy import sparse
+
+try:
+    import faiss
+    FAISS_AVAILABLE = True
+except ImportError:
+    FAISS_AVAILABLE = False
 
 # Thêm thư mục gốc vào PYTHONPATH
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 
 from app.models.movie_model import MovieModel
+from app.models._kernels import topk_scores
+
+# Catalog lớn hơn ngưỡng này thì so phim gốc với toàn bộ catalog mỗi query quá chậm:
+# dùng FAISS HNSW index để lấy ứng viên thay vì so với toàn bộ phim
+ANN_MIN_MOVIES = int(os.getenv('ANN_MIN_MOVIES', '20000'))
+ANN_DIM = 128
+ANN_CANDIDATES = 200
+# Số cột hash cho TF-IDF của overview: unigram + bigram rất nhiều, ít cột hơn thì va chạm hash
+# làm lệch ranking (và tạo cột giả qua min_df); ma trận thưa nên nhiều cột không tốn bộ nhớ
+OVERVIEW_HASH_FEATURES = 2 ** 20
+# Số cột hash cho cast / director / keywords (mỗi tên / từ là một feature, không cần vocabulary)
+TOKEN_HASH_FEATURES = 2 ** 14
+# Thể loại (chữ thường) có bit riêng trong genre_bits; 'sci-fi' dùng cho khung giờ ban đêm
+GENRE_NAMES = [
+    'action', 'adventure', 'animation', 'comedy', 'crime', 'documentary', 'drama', 'family',
+    'fantasy', 'foreign', 'history', 'horror', 'music', 'mystery', 'romance', 'science fiction',
+    'thriller', 'tv movie', 'war', 'western', 'sci-fi',
+]
+GENRE_BITS = {name: np.uint32(1 << i) for i, name in enumerate(GENRE_NAMES)}
+
+# Các cột phim trả về cho API (bỏ cột nội bộ như title_lower và các cột text lớn như cast/keywords)
+OUTPUT_COLUMNS = [
+    'id', 'title', 'genres', 'overview', 'tagline', 'release_date', 'year', 'runtime',
+    'vote_average', 'vote_count', 'popularity', 'director', 'poster_path', 'backdrop_path',
+]
+SCORE_COLUMNS = [
+    'similarity_score', 'genre_bonus', 'title_bonus', 'director_bonus',
+    'year_bonus', 'quality_bonus', 'final_score',
+]
+WORD_PATTERN = re.compile(r'(?u)\b\w\w+\b')  # Giống token_pattern mặc định của TfidfVectorizer
 
 def parse_genres(genres_data):
     """Parse genres from JSON string to set of genre names"""
@@ -28,12 +70,62 @@ def genres_to_text(genres_data):
     genres_set = parse_genres(genres_data)
     return ' '.join(genres_set)
 
+# Từ phổ biến không tính khi so khớp tên phim (franchise/series)
+COMMON_TITLE_WORDS = {'the', 'a', 'an', 'of', 'and', 'or', 'in', 'on', 'at', 'to', 'for'}
+
+def title_tokens(title):
+    """Các từ có nghĩa (lowercase) trong tên phim"""
+    return set(str(title).lower().split()) - COMMON_TITLE_WORDS
+
+def _field_tfidf(texts, hashing_features=None, min_df=1, max_features=None, **params):
+    """
+    TF-IDF của một feature; feature rỗng (không có từ nào) -> ma trận 0 cột.
+    hashing_features: dùng HashingVectorizer (không build vocabulary, một lượt qua dữ liệu);
+    min_df / max_features lọc trên các cột hash như TfidfVectorizer lọc vocabulary
+    """
+    try:
+        if hashing_features:
+            counts = HashingVectorizer(
+                stop_words='english', n_features=hashing_features,
+                alternate_sign=False, norm=None, **params
+            ).transform(texts).tocsc()
+            columns = np.flatnonzero(counts.getnnz(axis=0) >= min_df)
+            if max_features is not None and len(columns) > max_features:
+                term_counts = np.asarray(counts[:, columns].sum(axis=0)).ravel()
+                columns = np.sort(columns[np.argsort(-term_counts, kind='stable')[:max_features]])
+            if len(columns) == 0:
+                return sparse.csr_matrix((len(texts), 0))
+            return TfidfTransformer().fit_transform(counts[:, columns].tocsr())
+        return TfidfVectorizer(stop_words='english', min_df=min_df, max_features=max_features, **params).fit_transform(texts)
+    except ValueError:
+        return sparse.csr_matrix((len(texts), 0))
+
+def _hashed_tfidf(token_lists):
+    """TF-IDF trên các list token (FeatureHasher); không có token nào -> ma trận 0 cột"""
+    if not any(token_lists):
+        return sparse.csr_matrix((len(token_lists), 0))
+    hasher = FeatureHasher(n_features=TOKEN_HASH_FEATURES, input_type='string', alternate_sign=False)
+    return TfidfTransformer().fit_transform(hasher.transform(token_lists))
+
+def _word_tokens(text):
+    return [w for w in WORD_PATTERN.findall(text.lower()) if w not in ENGLISH_STOP_WORDS]
+
 class ContentBasedModel:
     def __init__(self, data_dir=None):
         # Use MovieModel to load movies data (handles missing files)
         self.movie_model = MovieModel(data_dir=data_dir)
-        self.tfidf_matrix = None
-        self.movie_similarity = None
+        self.tfidf_matrix = None  # Hàng đã chuẩn hóa L2: cosine = dot product
+        self.ann_index = None
+        self.genre_indicator = None  # N x G (CSR): phim i có thể loại j
+        # Mảng theo vị trí phim cho các điểm thưởng (xem _build_bonus_arrays)
+        self._ids = None
+        self._id_positions = None  # id phim -> vị trí (dòng đầu tiên) trong movies_df
+        self.genre_bits = None  # uint32 theo vị trí phim: bit của GENRE_BITS có trong chuỗi genres
+        self.genres_lower = None  # Chuỗi genres chữ thường (Series cùng index với movies_df)
+        self._title_token_index = None
+        self._directors = None
+        self._years = None
+        self._vote_averages = None
         self.movies_df = None
         self._build_model()
     
@@ -53,76 +145,172 @@ class ContentBasedModel:
 
             if self.movies_df.empty:
                 self.tfidf_matrix = None
-                self.movie_similarity = None
+                self.genre_indicator = None
                 return
-
-            # Build rich content combining multiple features with appropriate weights
-            # Genres: 7x weight (MOST CRITICAL - phải match genre trước tiên, tăng từ x5)
-            genres_text = self.movies_df['genres'].apply(genres_to_text).fillna('')
-            genres_weighted = (genres_text + ' ') * 7
-            
-            # Overview: 4x weight (chứa keywords quan trọng như "Godzilla", "monster", "zombie")
-            overview = ((self.movies_df['overview'].fillna('') + ' ') * 4) if 'overview' in self.movies_df.columns else ''
             
-            # Keywords: 3x weight (quan trọng cho content matching)
-            keywords_weighted = (self.movies_df['keywords'].fillna('') + ' ') * 3 if 'keywords' in self.movies_df.columns else ''
-            
-            # Director: 1x weight (giảm xuống vì có thể làm nhiễu)
-            director_weighted = (self.movies_df['director'].fillna('') + ' ') * 1 if 'director' in self.movies_df.columns else ''
+            # Parse JSON genres một lần cho cả TF-IDF lẫn genre overlap lúc query
+            genre_sets = self.movies_df['genres'].apply(parse_genres) if 'genres' in self.movies_df.columns else None
+            self.genre_indicator = self._build_genre_indicator(genre_sets)
+            self._build_bonus_arrays()
+
+            def text_column(column):
+                if column in self.movies_df.columns:
+                    return self.movies_df[column].fillna('').astype(str)
+                return pd.Series([''] * len(self.movies_df), index=self.movies_df.index)
             
-            # Cast: 1x weight (giảm xuống để tránh gợi ý sai do cùng diễn viên)
+            # Cast: chỉ lấy 3 actors, mỗi tên (lowercase) là một token
             def extract_cast(cast_data):
                 """Safely extract cast names from JSON string"""
-                if pd.isna(cast_data) or cast_data == '[]' or cast_data == '':
-                    return ''
+                if not isinstance(cast_data, (str, list)) or cast_data == '[]' or cast_data == '':
+                    return []
                 try:
-                    import json
                     cast_list = json.loads(cast_data) if isinstance(cast_data, str) else cast_data
                     if isinstance(cast_list, list):
-                        return ' '.join([actor.get('name', '') for actor in cast_list[:3]])  # Chỉ lấy 3 actors
+                        return [actor.get('name', '').lower() for actor in cast_list[:3] if actor.get('name')]  # Chỉ lấy 3 actors
                 except:
-                    return ''
-                return ''
-            
-            cast_text = self.movies_df['cast_data'].apply(extract_cast) if 'cast_data' in self.movies_df.columns else pd.Series([''] * len(self.movies_df))
-            cast_weighted = (cast_text + ' ') * 1
+                    return []
+                return []
             
-            # Tagline: 1x weight
-            tagline = self.movies_df['tagline'].fillna('') if 'tagline' in self.movies_df.columns else ''
+            cast_names = self.movies_df['cast_data'].apply(extract_cast).tolist() if 'cast_data' in self.movies_df.columns else [[]] * len(self.movies_df)
+            directors = [[name.lower()] if name else [] for name in text_column('director')]
+            keywords = [_word_tokens(text) for text in text_column('keywords')]
             
-            # Combine all features với thứ tự ưu tiên: Genres > Overview > Keywords > Director > Cast > Tagline
-            self.movies_df['content'] = (
-                genres_weighted.astype(str) + 
-                overview.astype(str) +
-                (keywords_weighted.astype(str) if isinstance(keywords_weighted, pd.Series) else '') +
-                (director_weighted.astype(str) if isinstance(director_weighted, pd.Series) else '') +
-                cast_weighted.astype(str) +
-                (tagline.astype(str) if isinstance(tagline, pd.Series) else '')
-            )
-
-            # Build TF-IDF with optimized parameters for better similarity detection
-            tfidf = TfidfVectorizer(
-                stop_words='english',
-                max_features=5000,  # Limit features for performance
-                ngram_range=(1, 2),  # Use unigrams and bigrams
-                min_df=2  # Ignore very rare terms
-            )
-            self.tfidf_matrix = tfidf.fit_transform(self.movies_df['content'])
-            self.movie_similarity = cosine_similarity(self.tfidf_matrix)
+            # Mỗi feature một TF-IDF riêng, trọng số nhân trên ma trận thưa (thay vì lặp chuỗi trước khi tokenize)
+            # Cast / director / keywords: feature hashing (vocabulary tên riêng rất lớn)
+            # Thứ tự ưu tiên: Genres > Overview > Keywords > Director > Cast > Tagline
+            fields = [
+                # Genres: 7x weight (MOST CRITICAL - phải match genre trước tiên)
+                (_field_tfidf(genre_sets.apply(' '.join) if genre_sets is not None else text_column('genres')), 7.0),
+                # Overview: 4x weight (chứa keywords quan trọng như "Godzilla", "monster", "zombie")
+                # (field lớn nhất, có bigram: hashing thay vì build vocabulary)
+                (_field_tfidf(text_column('overview'), ngram_range=(1, 2), min_df=2, max_features=5000,
+                              hashing_features=OVERVIEW_HASH_FEATURES), 4.0),
+                # Keywords: 3x weight (quan trọng cho content matching)
+                (_hashed_tfidf(keywords), 3.0),
+                # Director: 1x weight (giảm xuống vì có thể làm nhiễu)
+                (_hashed_tfidf(directors), 1.0),
+                # Cast: 1x weight (giảm xuống để tránh gợi ý sai do cùng diễn viên)
+                (_hashed_tfidf(cast_names), 1.0),
+                # Tagline: 1x weight
+                (_field_tfidf(text_column('tagline')), 1.0),
+            ]
+            tfidf_matrix = sparse.hstack([matrix * weight for matrix, weight in fields]).tocsr()
+            # Không giữ ma trận similarity N x N: chỉ ma trận TF-IDF thưa (đã chuẩn hóa L2),
+            # mỗi query tính một hàng similarity (xem _candidate_similarities)
+            self.tfidf_matrix = normalize(tfidf_matrix, norm='l2', copy=False)
+            if FAISS_AVAILABLE and len(self.movies_df) >= ANN_MIN_MOVIES:
+                self._build_ann_index()
 
         except Exception as e:
             print(f"Error building content-based model: {str(e)}")
             import traceback
             traceback.print_exc()
             self.tfidf_matrix = None
-            self.movie_similarity = None
+            self.ann_index = None
+            self.genre_indicator = None
             self.movies_df = pd.DataFrame()
     
+    def _build_bonus_arrays(self):
+        """Dựng sẵn id / token tên phim / director / year / vote_average dạng mảng theo vị trí"""
+        movies_df = self.movies_df
+        
+        def numeric(column):
+            if column not in movies_df.columns:
+                return None
+            return pd.to_numeric(movies_df[column], errors='coerce').to_numpy(dtype=np.float64)
+        
+        self._ids = movies_df['id'].to_numpy() if 'id' in movies_df.columns else np.full(len(movies_df), None)
+        self._directors = movies_df['director'].to_numpy(dtype=object) if 'director' in movies_df.columns else None
+        self._years = numeric('year')
+        self._vote_averages = numeric('vote_average')
+        
+        self._id_positions = {}
+        for pos, movie_id in enumerate(self._ids.tolist()):
+            self._id_positions.setdefault(movie_id, pos)
+        
+        # Bit của thể loại j bật khi tên thể loại xuất hiện trong chuỗi genres (chữ thường) của phim:
+        # cùng phép so chuỗi con như trước, nhưng tính một lần lúc build
+        self.genre_bits = np.zeros(len(movies_df), dtype=np.uint32)
+        self.genres_lower = None
+        if 'genres' in movies_df.columns:
+            self.genres_lower = movies_df['genres'].astype(str).str.lower()
+            for name, bit in GENRE_BITS.items():
+                self.genre_bits[self.genres_lower.str.contains(name, regex=False, na=False).to_numpy(dtype=bool)] |= bit
+        
+        # Inverted index: từ trong tên phim -> vị trí các phim chứa từ đó
+        self._title_token_index = None
+        if 'title' in movies_df.columns:
+            token_positions = {}
+            for pos, title in enumerate(movies_df['title']):
+                if pd.isna(title):
+                    continue
+                for token in title_tokens(title):
+                    token_positions.setdefault(token, []).append(pos)
+            self._title_token_index = {
+                token: np.asarray(positions, dtype=np.int64) for token, positions in token_positions.items()
+            }
+    
+    def movie_positions(self, movie_ids):
+        """Vị trí trong movies_df của từng id phim (-1 nếu không có)"""
+        positions = self._id_positions or {}
+        return np.fromiter(
+            (positions.get(movie_id, -1) for movie_id in movie_ids), dtype=np.int64, count=len(movie_ids)
+        )
+    
+    def _build_genre_indicator(self, genre_sets):
+        """Ma trận thưa phim x thể loại từ các set genres đã parse (None nếu không có cột genres)"""
+        if genre_sets is None:
+            return None
+        genre_col = {}
+        rows, cols = [], []
+        for row, genres in enumerate(genre_sets):
+            for genre in genres:
+                rows.append(row)
+                cols.append(genre_col.setdefault(genre, len(genre_col)))
+        return sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, cols)),
+            shape=(len(genre_sets), len(genre_col))
+        )
+    
+    def _build_ann_index(self):
+        """
+        Nén TF-IDF xuống ANN_DIM chiều (LSA), chuẩn hóa L2 và build FAISS HNSW index
+        (inner product trên vector chuẩn hóa = cosine)
+        """
+        svd = TruncatedSVD(n_components=min(ANN_DIM, self.tfidf_matrix.shape[1] - 1), random_state=42)
+        embeddings = svd.fit_transform(self.tfidf_matrix).astype(np.float32)
+        faiss.normalize_L2(embeddings)
+        # 8-bit scalar quantizer: 1 byte/chiều thay vì 4 (chỉ dùng để lấy ứng viên, điểm cuối vẫn tính chính xác)
+        index = faiss.IndexHNSWSQ(embeddings.shape[1], faiss.ScalarQuantizer.QT_8bit, 32, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = 80
+        index.train(embeddings)
+        index.add(embeddings)
+        self.ann_index = index
+        print(f"✓ FAISS HNSW index built (movies: {index.ntotal}, dim: {embeddings.shape[1]})")
+    
+    def _candidate_similarities(self, movie_idx, n_recommendations):
+        """
+        Trả về (vị trí các phim ứng viên, cosine similarity với phim gốc).
+        Không có ANN index: toàn bộ catalog, một phép nhân ma trận thưa với vector phim gốc.
+        """
+        if self.ann_index is None:
+            similarities = (self.tfidf_matrix @ self.tfidf_matrix[movie_idx].T).toarray().ravel()
+            return np.arange(len(self.movies_df)), similarities.astype(np.float32)
+        
+        k = min(max(n_recommendations * 20, ANN_CANDIDATES), self.ann_index.ntotal)
+        # Vector truy vấn lấy lại từ index (SQ8), không giữ thêm bản embeddings riêng
+        query = self.ann_index.reconstruct(int(movie_idx)).reshape(1, -1)
+        _, neighbors = self.ann_index.search(query, k)
+        candidates = neighbors[0][neighbors[0] >= 0]
+        # Điểm chính xác trên TF-IDF (các hàng đã được chuẩn hóa L2 bởi TfidfVectorizer)
+        similarities = (self.tfidf_matrix[candidates] @ self.tfidf_matrix[movie_idx].T).toarray().ravel()
+        return candidates, similarities
+    
     def get_recommendations(self, movie_id=None, n_recommendations=10):
         """
         Lấy gợi ý phim dựa trên Content-based Filtering với scoring thông minh
         """
-        if self.movie_similarity is None or self.movies_df.empty:
+        if self.tfidf_matrix is None or self.movies_df.empty:
             return []
             
         if movie_id is None:
@@ -137,121 +325,84 @@ class ContentBasedModel:
                     return []
         
         # Tìm index của phim trong dataframe
-        movie_matches = self.movies_df[self.movies_df['id'] == movie_id]
-        if movie_matches.empty:
+        movie_idx = self.movie_positions([movie_id])[0]
+        if movie_idx < 0:
             print(f"⚠️ Movie {movie_id} not found in content-based model")
             return []
         
-        movie_idx = movie_matches.index[0]
         source_movie = self.movies_df.iloc[movie_idx]
         
         # Lấy độ tương đồng với phim được chọn
-        movie_similarities = self.movie_similarity[movie_idx]
-        
-        # Tạo dataframe với similarity scores và additional scoring factors
-        similar_df = self.movies_df.copy()
-        similar_df['similarity_score'] = movie_similarities
+        candidate_pos, movie_similarities = self._candidate_similarities(movie_idx, n_recommendations)
         
-        # CRITICAL: Filter out movies with NO genre overlap (tránh gợi ý phim hoàn toàn khác thể loại)
-        if 'genres' in similar_df.columns and pd.notna(source_movie.get('genres')):
-            source_genres = parse_genres(source_movie.get('genres', ''))
-            
-            def has_genre_overlap(genres):
-                """Check if movie has at least 1 common genre"""
-                movie_genres = parse_genres(genres)
-                return len(source_genres & movie_genres) > 0
-            
-            # Chỉ giữ phim có ít nhất 1 thể loại chung
-            similar_df = similar_df[similar_df['genres'].apply(has_genre_overlap)]
+        # Các điểm thưởng tính trên mảng NumPy theo vị trí ứng viên (từ mảng dựng sẵn lúc build);
+        # chỉ top N mới được lấy ra thành DataFrame
+        n_candidates = len(candidate_pos)
+        keep = self._ids[candidate_pos] != movie_id  # Loại bỏ phim gốc
         
         # Bonus scoring cho các phim có cùng:
         # 1. Genres overlap (tối đa +0.40 - TĂNG MẠNH để ưu tiên genre matching)
-        if 'genres' in similar_df.columns:
-            source_genres = parse_genres(source_movie.get('genres', ''))
-            similar_df['genre_bonus'] = similar_df['genres'].apply(
-                lambda x: min(0.40, len(source_genres & parse_genres(x)) * 0.10)  # 0.10 per genre match
-            )
-        else:
-            similar_df['genre_bonus'] = 0
+        #    Số thể loại chung: một phép nhân ma trận thưa (không parse JSON mỗi query)
+        genre_bonus = np.zeros(n_candidates)
+        if self.genre_indicator is not None:
+            genre_overlap = (
+                self.genre_indicator[candidate_pos] @ self.genre_indicator[movie_idx].T
+            ).toarray().ravel()
+            genre_bonus = np.minimum(0.40, genre_overlap * 0.10)  # 0.10 per genre match
+            
+            # CRITICAL: Filter out movies with NO genre overlap (tránh gợi ý phim hoàn toàn khác thể loại)
+            if pd.notna(source_movie.get('genres')):
+                keep &= genre_overlap > 0
         
         # 2. Franchise/Title similarity bonus (+0.30 if title contains common keywords)
-        if 'title' in similar_df.columns and pd.notna(source_movie.get('title')):
-            source_title_words = set(str(source_movie['title']).lower().split())
-            # Remove common words
-            common_words = {'the', 'a', 'an', 'of', 'and', 'or', 'in', 'on', 'at', 'to', 'for'}
-            source_title_words = source_title_words - common_words
-            
-            def check_title_similarity(title):
-                if pd.isna(title):
-                    return 0
-                title_words = set(str(title).lower().split()) - common_words
-                # If any significant word matches, give big bonus (franchise/series)
-                if len(source_title_words & title_words) > 0:
-                    return 0.30
-                return 0
-            
-            similar_df['title_bonus'] = similar_df['title'].apply(check_title_similarity)
-        else:
-            similar_df['title_bonus'] = 0
+        title_bonus = np.zeros(n_candidates)
+        if self._title_token_index is not None and pd.notna(source_movie.get('title')):
+            # If any significant word matches, give big bonus (franchise/series)
+            title_match = np.zeros(len(self.movies_df), dtype=bool)
+            for token in title_tokens(source_movie['title']):
+                title_match[self._title_token_index.get(token, [])] = True
+            title_bonus[title_match[candidate_pos]] = 0.30
         
         # 3. Same director (giảm xuống +0.05 để tránh overweight)
-        if 'director' in similar_df.columns and pd.notna(source_movie.get('director')):
-            similar_df['director_bonus'] = similar_df['director'].apply(
-                lambda x: 0.05 if pd.notna(x) and x == source_movie['director'] else 0
-            )
-        else:
-            similar_df['director_bonus'] = 0
+        director_bonus = np.zeros(n_candidates)
+        if self._directors is not None and pd.notna(source_movie.get('director')):
+            director_bonus[self._directors[candidate_pos] == source_movie['director']] = 0.05
         
         # 4. Similar year (±5 years: +0.05)
-        if 'year' in similar_df.columns and pd.notna(source_movie.get('year')):
-            source_year = source_movie['year']
-            similar_df['year_bonus'] = similar_df['year'].apply(
-                lambda x: 0.05 if pd.notna(x) and abs(x - source_year) <= 5 else 0
-            )
-        else:
-            similar_df['year_bonus'] = 0
+        year_bonus = np.zeros(n_candidates)
+        if self._years is not None and pd.notna(source_movie.get('year')):
+            year_bonus[np.abs(self._years[candidate_pos] - float(source_movie['year'])) <= 5] = 0.05
         
         # 5. Quality factor: vote_average >= 6.0 gets small boost
-        if 'vote_average' in similar_df.columns:
-            similar_df['quality_bonus'] = similar_df['vote_average'].apply(
-                lambda x: 0.03 if pd.notna(x) and x >= 6.0 else 0
-            )
-        else:
-            similar_df['quality_bonus'] = 0
+        quality_bonus = np.zeros(n_candidates)
+        if self._vote_averages is not None:
+            quality_bonus[self._vote_averages[candidate_pos] >= 6.0] = 0.03
         
         # Calculate final score
-        similar_df['final_score'] = (
-            similar_df['similarity_score'] + 
-            similar_df['genre_bonus'] + 
-            similar_df['title_bonus'] +
-            similar_df['director_bonus'] +
-            similar_df['year_bonus'] +
-            similar_df['quality_bonus']
+        final_score = (
+            movie_similarities + genre_bonus + title_bonus +
+            director_bonus + year_bonus + quality_bonus
         )
         
-        # Loại bỏ phim gốc và sort theo final_score
-        similar_df = similar_df[similar_df['id'] != movie_id]
-        similar_df = similar_df.sort_values('final_score', ascending=False)
+        # Lấy top N theo final_score trong các ứng viên còn lại
+        kept = np.flatnonzero(keep)
+        top = kept[topk_scores(final_score[kept], n_recommendations)]
         
-        # Lấy top N recommendations
-        top_similar = similar_df.head(n_recommendations)
+        # Chỉ lấy các cột API cần; NaN/inf -> None cho JSON trên cả khung top N một lần
+        columns = [col for col in OUTPUT_COLUMNS if col in self.movies_df.columns]
+        top_similar = self.movies_df.iloc[candidate_pos[top]][columns].replace([np.inf, -np.inf], np.nan)
+        top_similar = top_similar.astype(object).where(top_similar.notna(), None)
+        recommendations = top_similar.to_dict(orient='records')
         
-        # Convert to list of dicts
-        recommendations = []
-        for idx, movie in top_similar.iterrows():
-            movie_dict = movie.to_dict()
-            # Handle NaN values before JSON serialization
-            for key, value in movie_dict.items():
-                if pd.isna(value):
-                    movie_dict[key] = None
-                elif isinstance(value, (np.floating, float)):
-                    if np.isnan(value) or np.isinf(value):
-                        movie_dict[key] = None
-                    else:
-                        movie_dict[key] = float(value)
-            
-            movie_dict['similarity_score'] = float(movie['similarity_score']) if not pd.isna(movie['similarity_score']) else 0.0
-            movie_dict['final_score'] = float(movie['final_score']) if not pd.isna(movie['final_score']) else 0.0
-            recommendations.append(movie_dict)
+        # Điểm lấy thẳng từ mảng NumPy
+        scores = np.nan_to_num(
+            np.column_stack([
+                movie_similarities[top], genre_bonus[top], title_bonus[top], director_bonus[top],
+                year_bonus[top], quality_bonus[top], final_score[top],
+            ]).astype(float),
+            nan=0.0, posinf=0.0, neginf=0.0,
+        ).tolist()
+        for movie_dict, row in zip(recommendations, scores):
+            movie_dict.update(zip(SCORE_COLUMNS, row))
         
         return recommendations 
\ No newline at end of file
@@ -8,11 +8,13 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 
 from app.models.collaborative_model import CollaborativeModel
 from app.models.content_based_model import ContentBasedModel
+from app.models._kernels import topk_scores
 
 class HybridModel:
-    def __init__(self, data_dir=None):
-        self.collaborative_model = CollaborativeModel(data_dir)
-        self.content_based_model = ContentBasedModel(data_dir)
+    def __init__(self, data_dir=None, collaborative_model=None, content_based_model=None):
+        # Reuse models đã build sẵn nếu được truyền vào (tránh load dữ liệu và build lại lần nữa)
+        self.collaborative_model = collaborative_model or CollaborativeModel(data_dir)
+        self.content_based_model = content_based_model or ContentBasedModel(data_dir)
     
     def get_recommendations(self, user_id=None, movie_id=None, n_recommendations=10):
         """
@@ -46,28 +48,31 @@ class HybridModel:
                 else:
                     movie_scores[movie['id']] = movie.get('similarity_score', 0)
             
-            # Sắp xếp phim theo điểm tổng hợp
-            sorted_movies = sorted(movie_scores.items(), key=lambda x: x[1], reverse=True)
-            
-            # Lấy top N phim
-            top_movie_ids = [movie_id for movie_id, _ in sorted_movies[:n_recommendations]]
+            # Lấy top N phim theo điểm tổng hợp
+            scored_ids = list(movie_scores.keys())
+            top_idx = topk_scores(np.fromiter(movie_scores.values(), dtype=np.float32, count=len(scored_ids)), n_recommendations)
+            top_movie_ids = [scored_ids[i] for i in top_idx]
             
             # Lấy thông tin chi tiết của các phim
             final_recommendations = []
             for movie_id in top_movie_ids:
-                movie_info = self.content_based_model.movies_df[self.content_based_model.movies_df['id'] == movie_id].iloc[0]
-                movie_dict = movie_info.to_dict()
-                # Replace NaN/inf with None for JSON serialization
-                movie_dict = {k: (None if pd.isna(v) or (isinstance(v, float) and np.isinf(v)) else v) for k, v in movie_dict.items()}
-                final_recommendations.append(movie_dict)
+                movie_dict = self._movie_info(movie_id)
+                if movie_dict is not None:
+                    final_recommendations.append(movie_dict)
         else:
             # Lấy thông tin chi tiết của các phim trong phần giao
             final_recommendations = []
             for movie_id in list(common_movie_ids)[:n_recommendations]:
-                movie_info = self.content_based_model.movies_df[self.content_based_model.movies_df['id'] == movie_id].iloc[0]
-                movie_dict = movie_info.to_dict()
-                # Replace NaN/inf with None for JSON serialization
-                movie_dict = {k: (None if pd.isna(v) or (isinstance(v, float) and np.isinf(v)) else v) for k, v in movie_dict.items()}
-                final_recommendations.append(movie_dict)
+                movie_dict = self._movie_info(movie_id)
+                if movie_dict is not None:
+                    final_recommendations.append(movie_dict)
         
-        return final_recommendations 
\ No newline at end of file
+        return final_recommendations
+    
+    def _movie_info(self, movie_id):
+        """Thông tin phim theo id: tra dict id -> phim của MovieModel (O(1)) thay vì lọc movies_df mỗi phim"""
+        movie_dict = self.content_based_model.movie_model.get_movie_by_id(movie_id)
+        if movie_dict is None:
+            return None
+        # Replace NaN/inf with None for JSON serialization
+        return {k: (None if pd.isna(v) or (isinstance(v, float) and np.isinf(v)) else v) for k, v in movie_dict.items()} 
\ No newline at end of file
@@ -1,13 +1,56 @@
 import pandas as pd
+import numpy as np
 import os
+import re
+import csv
+from functools import lru_cache
 from datetime import datetime
 try:
     from app.data import db_postgresql
-    from app.data.models import Rating, Review
+    from app.data.models import Rating, Review, User, Movie, movie_pk
 except Exception:
     # fallback when package root is different inside containers
     from data import db_postgresql
-    from data.models import Rating, Review
+    from data.models import Rating, Review, User, Movie, movie_pk
+from sqlalchemy import lambda_stmt, select
+from sqlalchemy.orm import selectinload
+
+try:
+    import pyarrow  # noqa: F401 - engine cho read_parquet
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+# Kiểu gọn hơn mặc định (int64/float64) cho các cột số đã biết, áp dụng lúc parse CSV.
+# vote_average giữ float64: float32 làm lệch giá trị thập phân trả về API (6.4 -> 6.400000095...)
+CSV_DTYPES = {
+    'id': 'int32',
+    'movieId': 'int32',
+    'userId': 'int32',
+    'vote_count': 'int32',
+    'year': 'int16',
+    'runtime': 'int16',
+    'rating': 'float32',
+}
+
+# Cột text lưu dạng Arrow string (bộ đệm UTF-8 liền + offsets): .str.* chạy trên kernel của Arrow
+TEXT_COLUMNS = ['title', 'title_lower', 'genres', 'overview', 'release_date']
+
+# Header của reviews.csv khi file chưa tồn tại
+REVIEW_CSV_COLUMNS = ['movieId', 'userId', 'rating', 'review', 'timestamp']
+
+# Số query (đã chuẩn hóa) nhớ kết quả cho search_movies / autocomplete
+SEARCH_CACHE_SIZE = 1024
+
+# Mỗi node của trie autocomplete giữ tối đa chừng này phim (theo vote_average giảm dần)
+AUTOCOMPLETE_NODE_LIMIT = 50
+
+
+def _downcast_integers(df):
+    """int64 -> kiểu nguyên nhỏ nhất đủ chứa giá trị (tại chỗ)"""
+    for column in df.select_dtypes(include='integer').columns:
+        df[column] = pd.to_numeric(df[column], downcast='integer')
+    return df
 
 
 def _safe_read_csv(path, default_columns=None, usecols=None, low_memory=True):
@@ -22,18 +65,89 @@ def _safe_read_csv(path, default_columns=None, usecols=None, low_memory=True):
         if os.path.getsize(path) == 0:
             return pd.DataFrame(columns=default_columns if default_columns is not None else [])
         
-        # Optimize memory usage
-        return pd.read_csv(
-            path, 
-            low_memory=low_memory,
-            usecols=usecols,
-            dtype={'id': 'int32'} if 'id' in (usecols or []) else None,
-            engine='c'
-        )
+        # Optimize memory usage: parse thẳng sang kiểu gọn (cột không có trong file được bỏ qua),
+        # memory_map: C parser đọc thẳng từ file đã map vào bộ nhớ thay vì qua buffer đọc file
+        read_options = dict(low_memory=low_memory, usecols=usecols, engine='c', memory_map=True)
+        try:
+            return pd.read_csv(path, dtype=CSV_DTYPES, **read_options)
+        except (ValueError, OverflowError):
+            # Cột nguyên có giá trị thiếu / không phải số: đọc mặc định rồi downcast các cột nguyên
+            return _downcast_integers(pd.read_csv(path, **read_options))
     except pd.errors.EmptyDataError:
         return pd.DataFrame(columns=default_columns if default_columns is not None else [])
 
 
+def _trie_insert(trie, key, row):
+    """Thêm `row` vào mọi node trên đường đi của `key` (row được thêm theo thứ tự xếp hạng)"""
+    node = trie
+    for ch in key:
+        node = node.setdefault(ch, {})
+        rows = node.setdefault('', [])  # '' không bao giờ là một ký tự: dùng làm key danh sách row
+        if len(rows) < AUTOCOMPLETE_NODE_LIMIT and (not rows or rows[-1] != row):
+            rows.append(row)
+
+
+def _trie_finalize(trie):
+    """Đổi danh sách row của mọi node sang mảng int32 (gọn hơn list Python)"""
+    stack = [trie]
+    while stack:
+        node = stack.pop()
+        for key, child in node.items():
+            if key == '':
+                node[key] = np.asarray(child, dtype=np.int32)
+            else:
+                stack.append(child)
+
+
+def _arrow_string_dtype():
+    """StringDtype lưu bằng pyarrow nhưng giá trị thiếu vẫn là NaN (như object dtype); None nếu không hỗ trợ"""
+    if not PARQUET_AVAILABLE:
+        return None
+    try:
+        return pd.StringDtype('pyarrow', na_value=np.nan)  # pandas >= 2.3 (mặc định của pandas 3)
+    except TypeError:
+        try:
+            return pd.StringDtype('pyarrow_numpy')  # pandas 2.1 - 2.2
+        except Exception:
+            return None
+
+
+def _to_arrow_strings(df):
+    """Chuyển các cột text (object dtype) của df sang Arrow string tại chỗ"""
+    dtype = _arrow_string_dtype()
+    if dtype is None:
+        return
+    for column in TEXT_COLUMNS:
+        if column in df.columns and df[column].dtype != dtype:
+            try:
+                df[column] = df[column].astype(dtype)
+            except Exception as e:
+                print(f"⚠️ Could not convert {column} to Arrow string: {e}")
+
+
+def _safe_read_table(path, default_columns=None):
+    """
+    Prefer the Parquet copy (written by preprocess_data, or here after the first CSV parse)
+    when it is not older than the CSV.
+    """
+    parquet_path = os.path.splitext(path)[0] + '.parquet'
+    if (PARQUET_AVAILABLE and os.path.exists(parquet_path) and
+            (not os.path.exists(path) or os.path.getmtime(parquet_path) >= os.path.getmtime(path))):
+        try:
+            return pd.read_parquet(parquet_path)
+        except Exception as e:
+            print(f"⚠️ Could not read {parquet_path}, falling back to CSV: {e}")
+    df = _safe_read_csv(path, default_columns)
+    
+    # Parse CSV một lần: các lần khởi động sau (worker khác, reload) đọc bản Parquet
+    if PARQUET_AVAILABLE and os.path.exists(path) and not df.empty:
+        try:
+            df.to_parquet(parquet_path, compression='zstd', index=False)
+        except Exception as e:
+            print(f"⚠️ Could not write {parquet_path}: {e}")
+    return df
+
+
 class MovieModel:
     def __init__(self, data_dir=None):
         if data_dir is None:
@@ -45,8 +159,8 @@ class MovieModel:
         ratings_path = os.path.join(data_dir, 'ratings_processed.csv')
         reviews_path = os.path.join(data_dir, 'reviews.csv')
 
-        # Read movies from CSV (static metadata)
-        self.movies_df = _safe_read_csv(movies_path)
+        # Read movies from Parquet/CSV (static metadata)
+        self.movies_df = _safe_read_table(movies_path)
 
         # Load ratings/reviews from PostgreSQL
         self.ratings_df = self._fetch_ratings_from_db()
@@ -54,6 +168,14 @@ class MovieModel:
 
         self.data_dir = data_dir
         self.reviews_path = reviews_path
+        self._reviews_csv_columns = None  # Header của reviews.csv (đọc một lần, xem _append_review_csv)
+        # Review mới (fallback CSV) chưa gộp vào reviews_df: gộp một lần khi cần đọc (_flush_review_buffer)
+        self._review_buffer = []
+        # {id: row dict} cho get_movie_by_id / get_movies_by_ids (build lười, xem _movies_by_id)
+        self._records = None  # Dict của từng dòng movies_df theo vị trí (xem _movie_records)
+        self._movie_index = None
+        self._movie_index_source = None
+        self._movie_index_columns = None
         # Precompute lowercase titles for fast searching/autocomplete
         try:
             if 'title' in self.movies_df.columns:
@@ -62,23 +184,47 @@ class MovieModel:
                 self.movies_df['title_lower'] = ''
         except Exception:
             self.movies_df['title_lower'] = ''
+        _to_arrow_strings(self.movies_df)
+        # Cột/mảng dùng chung cho search/autocomplete (không copy movies_df mỗi lần gõ phím)
+        self._titles_lower = self.movies_df['title_lower']
+        if 'vote_average' in self.movies_df.columns:
+            self._votes = pd.to_numeric(self.movies_df['vote_average'], errors='coerce').to_numpy(dtype=float)
+        else:
+            self._votes = np.full(len(self.movies_df), np.nan)
+        self._build_autocomplete_trie()
+        # release_date đã parse cho get_new_releases (không thêm cột vào movies_df)
+        self._release_dates = (
+            pd.to_datetime(self.movies_df['release_date'], errors='coerce')
+            if 'release_date' in self.movies_df.columns else None
+        )
+        # Kết quả chỉ phụ thuộc movies_df (cố định sau khi load): nhớ row index theo query đã chuẩn hóa,
+        # mỗi lần gọi vẫn tạo dict mới (API sửa dict trả về)
+        self._search_cache = lru_cache(maxsize=SEARCH_CACHE_SIZE)(self._search_rows)
+        self._autocomplete_cache = lru_cache(maxsize=SEARCH_CACHE_SIZE)(self._autocomplete_row_ids)
     
-    def _fetch_ratings_from_db(self):
-        """Fetch ratings from PostgreSQL database"""
+    def _fetch_ratings_from_db(self, user_ids=None):
+        """Fetch ratings from PostgreSQL database (only these users if user_ids is given)"""
         try:
             with db_postgresql.get_db_session() as db:
-                ratings = db.query(Rating).all()
-                if not ratings:
-                    return pd.DataFrame(columns=['userId', 'movieId', 'rating', 'timestamp'])
+                # Stream in batches (server-side cursor) instead of buffering the whole table;
+                # external ids come from the joins on the integer keys
+                query = db.query(
+                    User.user_id, Movie.movie_id, Rating.rating, Rating.timestamp
+                ).select_from(Rating).join(Rating.user).join(Rating.movie)
+                if user_ids is not None:
+                    query = query.filter(User.user_id.in_(list(user_ids)))
+                ratings = query.yield_per(5000)
                 
                 data = []
-                for r in ratings:
+                for user_id, movie_id, rating, timestamp in ratings:
                     data.append({
-                        'userId': r.user_id,
-                        'movieId': int(r.movie_id) if r.movie_id.isdigit() else r.movie_id,
-                        'rating': r.rating,
-                        'timestamp': r.timestamp.isoformat() if r.timestamp else None
+                        'userId': user_id,
+                        'movieId': int(movie_id) if movie_id.isdigit() else movie_id,
+                        'rating': rating,
+                        'timestamp': timestamp.isoformat() if timestamp else None
                     })
+                if not data:
+                    return pd.DataFrame(columns=['userId', 'movieId', 'rating', 'timestamp'])
                 return pd.DataFrame(data)
         except Exception as e:
             print(f"❌ Error fetching ratings from PostgreSQL: {e}")
@@ -89,17 +235,19 @@ class MovieModel:
         """Fetch reviews from PostgreSQL database"""
         try:
             with db_postgresql.get_db_session() as db:
-                reviews = db.query(Review).all()
+                reviews = db.query(
+                    Movie.movie_id, User.user_id, Review.rating, Review.review_text
+                ).select_from(Review).join(Review.movie).join(Review.user).all()
                 if not reviews:
                     return pd.DataFrame(columns=['movieId', 'userId', 'rating', 'review'])
                 
                 data = []
-                for r in reviews:
+                for movie_id, user_id, rating, review_text in reviews:
                     data.append({
-                        'movieId': int(r.movie_id) if r.movie_id.isdigit() else r.movie_id,
-                        'userId': r.user_id,
-                        'rating': r.rating,
-                        'review': r.review_text
+                        'movieId': int(movie_id) if movie_id.isdigit() else movie_id,
+                        'userId': user_id,
+                        'rating': rating,
+                        'review': review_text
                     })
                 return pd.DataFrame(data)
         except Exception as e:
@@ -107,6 +255,32 @@ class MovieModel:
             # Fallback to empty dataframe
             return pd.DataFrame(columns=['movieId', 'userId', 'rating', 'review'])
 
+    def _build_autocomplete_trie(self):
+        """
+        Prefix trie cho autocomplete: một trie theo cả title, một trie theo từng từ trong title.
+        Mỗi node giữ các row index đi qua nó, đã xếp theo vote_average giảm dần.
+        """
+        n_rows = len(self.movies_df)
+        # Thứ hạng chung: vote_average giảm dần (NaN cuối), cùng điểm thì theo thứ tự trong movies_df
+        order = np.lexsort((np.arange(n_rows), -np.nan_to_num(self._votes, nan=-np.inf)))
+        self._title_rank = np.empty(n_rows, dtype=np.int64)
+        self._title_rank[order] = np.arange(n_rows)
+        
+        self._title_trie = {}
+        self._word_trie = {}
+        self._title_exact = {}
+        titles = self._titles_lower.to_numpy(dtype=object)
+        for row in order.tolist():
+            title = titles[row]
+            if not isinstance(title, str):
+                continue
+            self._title_exact.setdefault(title, []).append(row)
+            _trie_insert(self._title_trie, title, row)
+            for word in title.split():
+                _trie_insert(self._word_trie, word, row)
+        _trie_finalize(self._title_trie)
+        _trie_finalize(self._word_trie)
+    
     def search_movies(self, query):
         """Search movies by partial/prefix matching with relevance scoring.
         
@@ -118,34 +292,20 @@ class MovieModel:
         """
         if not query or not query.strip():
             return []
+        return self._title_records(self._search_cache(query.lower().strip()))
+
+    def _search_rows(self, query_lower):
+        """Row index (tuple) của kết quả search_movies cho query đã chuẩn hóa"""
+        titles = self._titles_lower
         
-        query_lower = query.lower().strip()
-        df = self.movies_df.copy()
-        df['title_lower'] = df['title'].str.lower()
-        
-        # Score matches: higher score = better match
-        df['relevance'] = 0
-        
-        # Exact match: score 3
-        df.loc[df['title_lower'] == query_lower, 'relevance'] = 3
-        
-        # Starts with query: score 2
-        df.loc[df['title_lower'].str.startswith(query_lower), 'relevance'] = 2
-        
-        # Contains query: score 1
-        df.loc[df['title_lower'].str.contains(query_lower, case=False, na=False), 'relevance'] = 1
-        
-        # Filter to matches only
-        results = df[df['relevance'] > 0].copy()
-        
-        # Sort by: relevance (desc), then vote_average (desc)
-        results = results.sort_values(
-            by=['relevance', 'vote_average'],
-            ascending=[False, False]
-        ).head(20)  # Limit to top 20 results
+        # Score matches: higher score = better match (gán theo thứ tự ưu tiên tăng dần)
+        relevance = np.zeros(len(titles), dtype=np.int8)
+        relevance[titles.str.contains(query_lower, regex=False, na=False).to_numpy(dtype=bool)] = 1
+        relevance[titles.str.startswith(query_lower, na=False).to_numpy(dtype=bool)] = 2
+        relevance[(titles == query_lower).to_numpy(dtype=bool)] = 3
         
-        # Return as list of dicts, drop helper columns
-        return results.drop(columns=['title_lower', 'relevance']).to_dict('records')
+        # Sort by: relevance (desc), then vote_average (desc); limit to top 20 results
+        return self._top_title_rows(relevance, 20)
 
     def autocomplete(self, query, n=10):
         """Fast autocomplete: return up to `n` movies matching the query prefix or word-start.
@@ -160,54 +320,146 @@ class MovieModel:
         """
         if not query or not query.strip():
             return []
-        q = query.lower().strip()
-        df = self.movies_df.copy()
+        return self._title_records(self._autocomplete_cache(query.lower().strip(), n))
 
-        # initialize score
-        df['score'] = 0
+    def _autocomplete_row_ids(self, q, n):
+        """Row index (tuple) của kết quả autocomplete: qua trie, quét toàn bộ nếu trie không đủ"""
+        rows = self._autocomplete_rows(q, n) if 0 < n <= AUTOCOMPLETE_NODE_LIMIT else None
+        if rows is None:
+            rows = self._autocomplete_scan(q, n)
+        return tuple(rows)
 
-        # exact match
-        try:
-            df.loc[df['title_lower'] == q, 'score'] = 4
-        except Exception:
-            pass
+    @staticmethod
+    def _trie_rows(trie, key):
+        """(row index của node ứng với prefix `key`, danh sách có thể đã bị cắt hay không)"""
+        node = trie
+        for ch in key:
+            node = node.get(ch)
+            if node is None:
+                return (), False
+        rows = node.get('', ())
+        return rows, len(rows) >= AUTOCOMPLETE_NODE_LIMIT
 
-        # startswith full title
+    def _autocomplete_rows(self, q, n):
+        """
+        Top n row index cho autocomplete qua trie: exact > title prefix > word prefix > contains.
+        Trả về None khi một node bị cắt bớt trước khi đủ n phim (caller quét toàn bộ thay thế).
+        """
+        result = []
+        seen = set()
+        groups = [
+            (self._title_exact.get(q, ()), False),
+            self._trie_rows(self._title_trie, q),
+            self._trie_rows(self._word_trie, q),
+        ]
+        for rows, truncated in groups:
+            for row in rows:
+                row = int(row)
+                if row not in seen:
+                    seen.add(row)
+                    result.append(row)
+                    if len(result) == n:
+                        return result
+            if truncated:
+                return None
+        
+        # contains: chỉ quét title khi trie chưa đủ n phim
         try:
-            df.loc[df['title_lower'].str.startswith(q, na=False), 'score'] = df['score'].clip(lower=3)
+            contains = self._titles_lower.str.contains(q, regex=False, na=False).to_numpy(dtype=bool)
         except Exception:
-            pass
+            return result
+        matched = np.flatnonzero(contains)
+        for row in matched[np.argsort(self._title_rank[matched])].tolist():
+            if row not in seen:
+                result.append(row)
+                if len(result) == n:
+                    break
+        return result
 
-        # any word startswith
-        try:
-            df_word = df['title_lower'].str.split('\\s+')
-            mask = df_word.apply(lambda toks: any(t.startswith(q) for t in toks) if isinstance(toks, list) else False)
-            df.loc[mask, 'score'] = df['score'].clip(lower=2)
-        except Exception:
-            pass
+    def _autocomplete_scan(self, q, n):
+        """Autocomplete bằng cách chấm điểm mọi title (dùng khi n vượt quá giới hạn của trie)"""
+        titles = self._titles_lower
+
+        # Mỗi mức là tập con của mức thấp hơn: gán tăng dần = lấy điểm cao nhất
+        score = np.zeros(len(titles), dtype=np.int8)
 
         # contains
         try:
-            df.loc[df['title_lower'].str.contains(q, case=False, na=False), 'score'] = df['score'].clip(lower=1)
+            score[titles.str.contains(q, regex=False, na=False).to_numpy(dtype=bool)] = 1
         except Exception:
             pass
 
-        results = df[df['score'] > 0].copy()
-        if results.empty:
-            return []
+        # any word startswith: một regex trên cả cột (từ không chứa khoảng trắng nên query có
+        # khoảng trắng không khớp từ nào)
+        if len(q.split()) == 1:
+            try:
+                word_start = titles.str.contains(r'(?:^|\s)' + re.escape(q), regex=True, na=False)
+                score[word_start.to_numpy(dtype=bool)] = 2
+            except Exception:
+                pass
+
+        # startswith full title
+        score[titles.str.startswith(q, na=False).to_numpy(dtype=bool)] = 3
+
+        # exact match
+        score[(titles == q).to_numpy(dtype=bool)] = 4
+
+        return self._top_title_rows(score, n)
+
+    def _top_title_rows(self, score, n):
+        """
+        Row index của tối đa n phim có score > 0: score giảm dần, rồi vote_average giảm dần (NaN cuối),
+        cùng điểm thì giữ thứ tự trong movies_df
+        """
+        matched = np.flatnonzero(score > 0)
+        votes = np.nan_to_num(self._votes[matched], nan=-np.inf)
+        order = np.lexsort((-votes, -score[matched]))[:n]
+        return tuple(matched[order].tolist())
 
-        results = results.sort_values(by=['score', 'vote_average'], ascending=[False, False]).head(n)
-        # drop helper cols
-        for col in ['title_lower', 'score']:
-            if col in results.columns:
-                results = results.drop(columns=[col])
-        return results.to_dict('records')
+    def _title_records(self, rows):
+        """Dict (mới) của các dòng `rows` cho kết quả search/autocomplete (bỏ cột title_lower)"""
+        return self._rows(rows, exclude=('title_lower',))
+    
+    def _rows(self, rows, exclude=()):
+        """
+        Dict (bản sao) của các dòng `rows` (vị trí trong movies_df), giữ thứ tự.
+        Tra self._records[i]: O(K) theo số dòng trả về, không to_dict() cả DataFrame mỗi request.
+        """
+        records = self._movie_records()
+        if exclude:
+            return [{key: value for key, value in records[i].items() if key not in exclude} for i in rows]
+        return [dict(records[i]) for i in rows]
+    
+    def _movie_records(self):
+        """
+        Dict của từng dòng movies_df theo vị trí + index {id: dict} (dòng đầu tiên của mỗi id),
+        dùng chung các dict (chỉ đọc). Build lại khi movies_df bị thay thế hoặc thêm cột.
+        """
+        columns = tuple(self.movies_df.columns)
+        if self._movie_index_source is not self.movies_df or self._movie_index_columns != columns:
+            self._records = self.movies_df.to_dict('records')
+            self._movie_index = {}
+            if 'id' in self.movies_df.columns:
+                for movie in self._records:
+                    self._movie_index.setdefault(movie['id'], movie)
+            self._movie_index_source = self.movies_df
+            self._movie_index_columns = columns
+        return self._records
+    
+    def _movies_by_id(self):
+        """{id: row dict} cho toàn bộ movies_df, tra cứu O(1) thay vì lọc DataFrame mỗi lần"""
+        self._movie_records()
+        return self._movie_index
     
     def get_movie_by_id(self, movie_id):
-        movie = self.movies_df[self.movies_df['id'] == movie_id]
-        if not movie.empty:
-            return movie.iloc[0].to_dict()
-        return None
+        movie = self._movies_by_id().get(movie_id)
+        # Bản sao: caller (API) có thể sửa dict trả về
+        return dict(movie) if movie is not None else None
+    
+    def get_movies_by_ids(self, movie_ids):
+        """Nhiều phim theo id (bản sao dict), giữ thứ tự movie_ids"""
+        by_id = self._movies_by_id()
+        return [dict(by_id[movie_id]) for movie_id in dict.fromkeys(movie_ids) if movie_id in by_id]
     
     def add_review(self, movie_id, rating, review, username="Anonymous"):
         """Add a review to the persistent DB (and fallback CSV if DB unavailable)."""
@@ -215,26 +467,40 @@ class MovieModel:
             database.insert_review(movie_id, username, rating, review, data_dir=self.data_dir)
             # refresh in-memory dataframe
             self.reviews_df = database.fetch_reviews_df(self.data_dir)
+            self._review_buffer.clear()
             print(f"✓ Review saved to DB: movie_id={movie_id}, username={username}, rating={rating}")
             return True
         except Exception:
             # fallback to CSV append
             import datetime
-            new_review = pd.DataFrame({
-                'movieId': [movie_id],
-                'userId': [username],
-                'rating': [rating],
-                'review': [review],
-                'timestamp': [datetime.datetime.now().isoformat()]
-            })
-            self.reviews_df = pd.concat([self.reviews_df, new_review], ignore_index=True)
+            new_review = {
+                'movieId': movie_id,
+                'userId': username,
+                'rating': rating,
+                'review': review,
+                'timestamp': datetime.datetime.now().isoformat()
+            }
+            self._review_buffer.append(new_review)
             try:
-                self.reviews_df.to_csv(self.reviews_path, index=False)
+                self._append_review_csv(new_review)
             except Exception:
                 pass
             print(f"✓ Review saved to CSV fallback: movie_id={movie_id}, username={username}, rating={rating}")
             return True
 
+    def _append_review_csv(self, review):
+        """Ghi thêm 1 dòng vào cuối reviews.csv (append-only: không ghi lại cả file mỗi review)"""
+        if not os.path.exists(self.reviews_path) or os.path.getsize(self.reviews_path) == 0:
+            self._reviews_csv_columns = None
+            with open(self.reviews_path, 'w', newline='', encoding='utf-8') as f:
+                csv.writer(f).writerow(REVIEW_CSV_COLUMNS)
+        if self._reviews_csv_columns is None:
+            # Giữ đúng thứ tự cột của file đang có
+            with open(self.reviews_path, newline='', encoding='utf-8') as f:
+                self._reviews_csv_columns = next(csv.reader(f), None) or REVIEW_CSV_COLUMNS
+        with open(self.reviews_path, 'a', newline='', encoding='utf-8') as f:
+            csv.DictWriter(f, fieldnames=self._reviews_csv_columns, extrasaction='ignore').writerow(review)
+
     def add_user(self, user_id, metadata=None):
         try:
             database.insert_user(user_id, metadata, data_dir=self.data_dir)
@@ -283,8 +549,18 @@ class MovieModel:
             print(f"❌ Error recording rating: {e}")
             return False
     
+    def _flush_review_buffer(self):
+        """Gộp các review trong buffer vào reviews_df (một lần concat cho cả buffer)"""
+        if self._review_buffer:
+            self.reviews_df = pd.concat(
+                [self.reviews_df, pd.DataFrame(self._review_buffer)], ignore_index=True
+            )
+            self._review_buffer.clear()
+        return self.reviews_df
+
     def get_movie_reviews(self, movie_id):
-        return self.reviews_df[self.reviews_df['movieId'] == movie_id].to_dict('records')
+        reviews_df = self._flush_review_buffer()
+        return reviews_df[reviews_df['movieId'] == movie_id].to_dict('records')
 
     def add_comment(self, movie_id, user_id, comment_text):
         """Add comment as a review in PostgreSQL"""
@@ -320,9 +596,13 @@ class MovieModel:
                 from app.data.models import Review
                 
                 # Fetch reviews for this movie
-                reviews = db.query(Review).filter(
-                    Review.movie_id == str(movie_id)
-                ).order_by(Review.timestamp.desc()).offset(offset).limit(limit).all()
+                # lambda_stmt: SQL built/compiled once, mid/offset/limit are bound per call
+                mid = str(movie_id)
+                reviews = db.execute(lambda_stmt(
+                    lambda: select(Review).where(Review.movie_pk == movie_pk(mid))
+                    .options(selectinload(Review.user), selectinload(Review.movie))
+                    .order_by(Review.timestamp.desc()).offset(offset).limit(limit)
+                )).scalars().all()
                 
                 # Convert to dict format
                 comments = []
@@ -364,42 +644,39 @@ class MovieModel:
             # Lấy phim có interactions gần đây từ DB
             trending_data = database.get_trending_movies(limit=limit, data_dir=self.data_dir)
             if trending_data:
-                # Enrich with full movie data from CSV
-                movie_ids = [m.get('movieId') or m.get('id') for m in trending_data if m.get('movieId') or m.get('id')]
-                if movie_ids and len(self.movies_df) > 0:
-                    movies_dict = self.movies_df[self.movies_df['id'].isin(movie_ids)].set_index('id').to_dict('index')
-                    for item in trending_data:
-                        mid = item.get('movieId') or item.get('id')
-                        if mid in movies_dict:
-                            # Merge interaction data with full movie data
-                            item.update(movies_dict[mid])
+                # Enrich with full movie data from CSV (tra dict id -> phim, không lọc movies_df)
+                movies_by_id = self._movies_by_id()
+                for item in trending_data:
+                    movie = movies_by_id.get(item.get('movieId') or item.get('id'))
+                    if movie is not None:
+                        # Merge interaction data with full movie data
+                        item.update({key: value for key, value in movie.items() if key != 'id'})
                 return trending_data
         except Exception:
             pass
         
         # Fallback: lấy top rated films từ CSV
         if len(self.movies_df) > 0:
-            df = self.movies_df.copy()
-            # Ensure vote_average exists and sort
-            if 'vote_average' in df.columns:
-                df = df.dropna(subset=['vote_average'])
-                df = df.sort_values('vote_average', ascending=False).head(limit)
-                return df.to_dict('records')
+            # Ensure vote_average exists and sort (chỉ sort cột, lấy đúng các dòng top)
+            if 'vote_average' in self.movies_df.columns:
+                top = self.movies_df['vote_average'].dropna().sort_values(ascending=False).head(limit)
+                return self._rows(self.movies_df.index.get_indexer(top.index))
         
         return []
 
     def get_new_releases(self, limit=20):
         """Lấy phim mới nhất."""
         try:
-            df = self.movies_df.copy()
-            if 'release_date' in df.columns:
-                df['release_date'] = pd.to_datetime(df['release_date'], errors='coerce')
-                df = df.dropna(subset=['release_date'])
-                df = df.sort_values('release_date', ascending=False).head(limit)
-                return df.to_dict('records')
-            elif 'year' in df.columns:
-                df = df.sort_values('year', ascending=False).head(limit)
-                return df.to_dict('records')
+            if self._release_dates is not None:
+                # Ngày phát hành đã parse sẵn lúc load: chỉ sort một cột, không copy movies_df
+                top = self._release_dates.dropna().sort_values(ascending=False).head(limit)
+                movies = self._rows(self.movies_df.index.get_indexer(top.index))
+                for movie, release_date in zip(movies, top):
+                    movie['release_date'] = release_date
+                return movies
+            elif 'year' in self.movies_df.columns:
+                top = self.movies_df['year'].sort_values(ascending=False).head(limit)
+                return self._rows(self.movies_df.index.get_indexer(top.index))
         except Exception:
             pass
         
@@ -407,7 +684,5 @@ class MovieModel:
 
     def get_all_movies(self, limit=None):
         """Lấy tất cả phim hoặc limit."""
-        df = self.movies_df.copy()
-        if limit:
-            df = df.head(limit)
-        return df.to_dict('records')
+        rows = range(len(self.movies_df))
+        return self._rows(rows[:limit] if limit else rows)
@@ -2,15 +2,70 @@ import pandas as pd
 import numpy as np
 import sys
 import os
-from datetime import datetime, timedelta
-from collections import Counter
+import re
+from datetime import datetime
 import time
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
 
 # Thêm thư mục gốc vào PYTHONPATH
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 
 from app.models.collaborative_model import CollaborativeModel
-from app.models.content_based_model import ContentBasedModel
+from app.models.content_based_model import ContentBasedModel, GENRE_BITS
+from app.models._kernels import topk_scores, context_scores
+
+# Thể loại hợp với từng khung giờ: (giờ bắt đầu, giờ kết thúc, thể loại); ngoài các khung này là ban đêm
+TIME_OF_DAY_GENRES = [
+    (6, 12, ['comedy', 'animation', 'family']),  # Morning: Light, Comedy, Animation
+    (12, 18, ['action', 'adventure', 'family']),  # Afternoon: Action, Adventure, Family
+    (18, 24, ['drama', 'thriller', 'horror', 'romance']),  # Evening: Drama, Thriller, Horror
+]
+NIGHT_GENRES = ['horror', 'thriller', 'sci-fi']  # Night (0-6): Horror, Thriller, Sci-Fi
+
+# Behavior đã phân tích giữ trong Redis (REDIS_URL) để mọi worker dùng chung, key = behavior:<user_id>
+BEHAVIOR_CACHE_TTL = 300  # 5 minutes
+BEHAVIOR_CACHE_SIZE = 10000  # số user tối đa trong cache dict dự phòng (LRU) khi không có Redis
+REDIS_RETRY_SECONDS = 60
+
+# Behavior tính sẵn trong user_profiles (scripts/precompute_user_behavior.py, chạy hằng đêm)
+BEHAVIOR_PROFILE_TTL = timedelta(hours=24)
+
+# Thread pool dùng chung để chạy song song các bước độc lập (chủ yếu chờ I/O: DB, Redis)
+THREAD_POOL_SIZE = int(os.getenv('THREAD_POOL_SIZE', (os.cpu_count() or 1) * 5))
+_executor = ThreadPoolExecutor(max_workers=THREAD_POOL_SIZE, thread_name_prefix='personalized')
+
+
+def most_common(values, n):
+    """
+    n cặp (giá trị, số lần) xuất hiện nhiều nhất, giống Counter.most_common (hòa thì giá trị gặp trước đứng trước):
+    factorize ra mã số nguyên theo thứ tự gặp rồi đếm bằng np.bincount
+    """
+    codes, uniques = pd.factorize(values)
+    if len(uniques) == 0:
+        return []
+    counts = np.bincount(codes, minlength=len(uniques))
+    order = np.lexsort((np.arange(len(uniques)), -counts))[:n]
+    labels = uniques.tolist()
+    return [(labels[i], int(counts[i])) for i in order]
+
+
+def time_of_day_genres(hour):
+    """Thể loại hợp với giờ `hour` trong ngày"""
+    for start, end, genres in TIME_OF_DAY_GENRES:
+        if start <= hour < end:
+            return genres
+    return NIGHT_GENRES
+
 
 class PersonalizedRecommendationModel:
     """
@@ -22,13 +77,91 @@ class PersonalizedRecommendationModel:
     - Đánh giá và phản hồi (ratings, likes)
     """
     
-    def __init__(self, data_dir=None):
+    def __init__(self, data_dir=None, collaborative_model=None, content_based_model=None):
         self.data_dir = data_dir
-        self.collaborative_model = CollaborativeModel(data_dir)
-        self.content_based_model = ContentBasedModel(data_dir)
-        # Cache for user behavior analysis
-        self._behavior_cache = {}
-        self._cache_duration = 300  # 5 minutes
+        # Reuse models đã build sẵn nếu được truyền vào (tránh load dữ liệu và build lại lần nữa)
+        self.collaborative_model = collaborative_model or CollaborativeModel(data_dir)
+        self.content_based_model = content_based_model or ContentBasedModel(data_dir)
+        # Cache for user behavior analysis: Redis nếu có cấu hình, dict trong process khi Redis không dùng được
+        self._behavior_cache = OrderedDict()
+        self._behavior_cache_lock = threading.Lock()
+        self._cache_duration = BEHAVIOR_CACHE_TTL
+        self._redis = self._connect_redis()
+        self._redis_retry_at = 0.0
+        # genres/year theo id phim cho analyze_user_behavior (build lười, xem _movie_genre_year)
+        self._movie_meta = None
+        self._movie_meta_source = None
+    
+    @staticmethod
+    def _connect_redis():
+        """Redis client từ REDIS_URL (None nếu chưa cài redis hoặc không cấu hình)"""
+        url = os.getenv('REDIS_URL')
+        if not (REDIS_AVAILABLE and url):
+            return None
+        try:
+            return redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        except Exception as e:
+            print(f"⚠️ Redis behavior cache disabled: {e}")
+            return None
+    
+    def _shared_cache(self):
+        """Redis client đang dùng được (None khi không cấu hình hoặc đang chờ thử lại sau lỗi)"""
+        if self._redis is None or time.monotonic() < self._redis_retry_at:
+            return None
+        return self._redis
+    
+    def _redis_unavailable(self, error):
+        """Redis lỗi: dùng dict trong process một lúc thay vì thử lại mỗi request"""
+        print(f"⚠️ Redis behavior cache unavailable, retrying in {REDIS_RETRY_SECONDS}s: {error}")
+        self._redis_retry_at = time.monotonic() + REDIS_RETRY_SECONDS
+    
+    def _get_cached_behavior(self, user_id):
+        shared = self._shared_cache()
+        if shared is not None:
+            try:
+                raw = shared.get(f"behavior:{user_id}")
+                return json.loads(raw) if raw else None
+            except Exception as e:
+                self._redis_unavailable(e)
+        
+        cache_key = f"behavior_{user_id}"
+        with self._behavior_cache_lock:
+            cached_entry = self._behavior_cache.get(cache_key)
+            if cached_entry is None:
+                return None
+            if time.monotonic() - cached_entry["timestamp"] >= self._cache_duration:
+                del self._behavior_cache[cache_key]
+                return None
+            self._behavior_cache.move_to_end(cache_key)
+            return cached_entry["data"]
+    
+    def _set_cached_behavior(self, user_id, behavior):
+        shared = self._shared_cache()
+        if shared is not None:
+            try:
+                shared.setex(f"behavior:{user_id}", self._cache_duration, json.dumps(behavior))
+                return
+            except Exception as e:
+                self._redis_unavailable(e)
+        
+        with self._behavior_cache_lock:
+            self._behavior_cache[f"behavior_{user_id}"] = {
+                "data": behavior,
+                "timestamp": time.monotonic()
+            }
+            self._behavior_cache.move_to_end(f"behavior_{user_id}")
+            while len(self._behavior_cache) > BEHAVIOR_CACHE_SIZE:
+                self._behavior_cache.popitem(last=False)
+    
+    def _movie_genre_year(self):
+        """genres/year index theo id phim (dòng đầu tiên nếu id trùng), build lại khi movies_df bị thay thế"""
+        movies_df = self.content_based_model.movies_df
+        if self._movie_meta_source is not movies_df:
+            self._movie_meta = (
+                movies_df.drop_duplicates('id').set_index('id').reindex(columns=['genres', 'year'])
+            )
+            self._movie_meta_source = movies_df
+        return self._movie_meta
     
     def analyze_user_behavior(self, user_id):
         """
@@ -41,20 +174,41 @@ class PersonalizedRecommendationModel:
         Uses caching to avoid repeated expensive computations
         """
         # Check cache first
-        current_time = time.time()
-        cache_key = f"behavior_{user_id}"
+        cached = self._get_cached_behavior(user_id)
+        if cached is not None:
+            return cached
         
-        if cache_key in self._behavior_cache:
-            cached_entry = self._behavior_cache[cache_key]
-            if current_time - cached_entry["timestamp"] < self._cache_duration:
-                return cached_entry["data"]
+        # Profile tính sẵn offline: một SELECT theo user_id; chỉ tính lại khi chưa có / quá cũ
+        behavior = self._load_stored_behavior(user_id)
+        if behavior is None:
+            behavior = self._compute_behavior(user_id)
         
+        # Cache the result
+        self._set_cached_behavior(user_id, behavior)
+        
+        return behavior
+    
+    def _load_stored_behavior(self, user_id):
+        """Behavior trong user_profiles (None nếu chưa có, quá BEHAVIOR_PROFILE_TTL hoặc DB lỗi)"""
+        try:
+            try:
+                from app.data import db_postgresql
+            except Exception:
+                from data import db_postgresql
+            with db_postgresql.get_db_session() as db:
+                return db_postgresql.get_user_behavior(db, str(user_id), max_age=BEHAVIOR_PROFILE_TTL)
+        except Exception:
+            return None
+    
+    def _compute_behavior(self, user_id):
+        """Tính behavior từ watch history + ratings trong PostgreSQL (không qua cache)"""
         try:
             from app.data import db_postgresql
-            from app.data.models import WatchHistory, Rating
+            from app.data.models import WatchHistory, Rating, Movie, user_pk
         except Exception:
             from data import db_postgresql
-            from data.models import WatchHistory, Rating
+            from data.models import WatchHistory, Rating, Movie, user_pk
+        from sqlalchemy import lambda_stmt, select, func
         
         behavior = {
             'favorite_genres': [],
@@ -66,95 +220,99 @@ class PersonalizedRecommendationModel:
         }
         
         try:
-            # 1. Analyze watch history from PostgreSQL
+            # 1. Watch history + rating trung bình từ PostgreSQL: một session cho cả hai query
             with db_postgresql.get_db_session() as db:
-                watch_history_records = db.query(WatchHistory).filter(
-                    WatchHistory.user_id == str(user_id)
-                ).order_by(WatchHistory.watched_at.desc()).limit(100).all()
-                
-                watch_history = []
-                for record in watch_history_records:
-                    watch_history.append({
-                        'movieId': int(record.movie_id) if record.movie_id.isdigit() else record.movie_id,
-                        'viewed_at': record.watched_at.isoformat() if record.watched_at else None
-                    })
+                # lambda_stmt: SQL built/compiled once, uid is bound per call
+                uid = str(user_id)
+                # JOIN movies lấy đúng 2 cột cần dùng, không load ORM object
+                watch_history_records = db.execute(lambda_stmt(
+                    lambda: select(Movie.movie_id, WatchHistory.watched_at)
+                    .join(Movie, WatchHistory.movie_pk == Movie.id)
+                    .where(WatchHistory.user_pk == user_pk(uid))
+                    .order_by(WatchHistory.watched_at.desc()).limit(100)
+                )).all()
+                # AVG tính ở server: trả về một số thay vì mọi dòng rating của user
+                # (select thường: lambda_stmt không nhận `func` làm biến closure)
+                avg_rating = db.execute(
+                    select(func.avg(Rating.rating)).where(Rating.user_pk == user_pk(uid))
+                ).scalar()
+            
+            # watched_at giữ nguyên datetime từ driver (không isoformat rồi parse lại)
+            watch_history = pd.DataFrame(watch_history_records, columns=['movieId', 'viewed_at'])
+            watch_history['movieId'] = [
+                int(movie_id) if movie_id.isdigit() else movie_id for movie_id in watch_history['movieId']
+            ]
             
             behavior['total_watched'] = len(watch_history)
             
-            # Extract watch times (hours of day)
-            watch_times = []
-            recent_movie_ids = []
-            for entry in watch_history[:20]:  # Last 20 movies
-                try:
-                    timestamp = entry.get('viewed_at')
-                    if timestamp:
-                        dt = datetime.fromisoformat(timestamp)
-                        watch_times.append(dt.hour)
-                        
-                        # Recent movies (last 7 days)
-                        if datetime.now() - dt < timedelta(days=7):
-                            recent_movie_ids.append(entry.get('movieId'))
-                except:
-                    pass
+            # Extract watch times (hours of day) của 20 phim cuối; watched_at lưu theo UTC (naive)
+            last_watched = watch_history.head(20)
+            viewed_at = pd.to_datetime(last_watched['viewed_at'], utc=True)
+            has_time = viewed_at.notna().to_numpy()
+            behavior['watch_times'] = viewed_at[has_time].dt.hour.tolist()
+            
+            # Recent movies (last 7 days); watched_at lưu theo UTC
+            now = pd.Timestamp.now(tz='UTC')
+            recent_mask = has_time & ((now - viewed_at) < pd.Timedelta(days=7)).to_numpy()
+            recent_movie_ids = last_watched.loc[recent_mask, 'movieId'].tolist()
             
-            behavior['watch_times'] = watch_times
+            # 2. Analyze genres from watched movies: một lần join theo id thay vì lọc movies_df từng phim
+            watched = watch_history[['movieId']].merge(
+                self._movie_genre_year(), left_on='movieId', right_index=True, how='inner'
+            )
+            genres = watched['genres'].fillna('').astype(str).str.split('|').explode().str.strip()
+            is_genre = genres != ''
+            top_genres = most_common(genres[is_genre], 10)
             
-            # 2. Analyze genres from watched movies
-            movies_df = self.content_based_model.movies_df
-            genre_counter = Counter()
-            recent_genre_counter = Counter()
-            decades = []
+            # Recent genres
+            is_recent = watched['movieId'].isin(recent_movie_ids).reindex(genres.index)
+            top_recent_genres = most_common(genres[is_genre & is_recent], 5)
             
-            for entry in watch_history:
-                movie_id = entry.get('movieId')
-                movie = movies_df[movies_df['id'] == movie_id]
-                if not movie.empty:
-                    movie_data = movie.iloc[0]
-                    genres = str(movie_data.get('genres', '')).split('|')
-                    for genre in genres:
-                        genre = genre.strip()
-                        if genre:
-                            genre_counter[genre] += 1
-                            
-                            # Recent genres
-                            if movie_id in recent_movie_ids:
-                                recent_genre_counter[genre] += 1
-                    
-                    # Analyze preferred decade
-                    year = movie_data.get('year')
-                    if year and year > 1900:
-                        decades.append((year // 10) * 10)
+            # Analyze preferred decade
+            years = pd.to_numeric(watched['year'], errors='coerce').to_numpy(dtype=np.float64)
+            years = years[np.isfinite(years) & (years > 1900)].astype(np.int32)
+            decades = (years // 10) * 10
             
             # Top 5 favorite genres (tăng từ 3 lên 5 để coverage tốt hơn)
-            behavior['favorite_genres'] = [g for g, _ in genre_counter.most_common(5)]
-            behavior['recent_genres'] = [g for g, _ in recent_genre_counter.most_common(5)]
-            behavior['genre_weights'] = {g: count for g, count in genre_counter.most_common(10)}
+            behavior['favorite_genres'] = [g for g, _ in top_genres[:5]]
+            behavior['recent_genres'] = [g for g, _ in top_recent_genres]
+            behavior['genre_weights'] = {g: count for g, count in top_genres}
             
-            # Most watched decade
-            if decades:
-                behavior['preferred_decade'] = Counter(decades).most_common(1)[0][0]
+            # Most watched decade: histogram bằng np.bincount; hòa thì lấy decade gặp trước (như Counter.most_common)
+            if decades.size:
+                counts = np.bincount((decades - decades.min()) // 10)
+                is_top = counts[(decades - decades.min()) // 10] == counts.max()
+                behavior['preferred_decade'] = int(decades[np.argmax(is_top)])
             
-            # 3. Analyze ratings from PostgreSQL
-            with db_postgresql.get_db_session() as db:
-                user_ratings = db.query(Rating).filter(
-                    Rating.user_id == str(user_id)
-                ).all()
-                
-                if user_ratings:
-                    ratings = [r.rating for r in user_ratings]
-                    behavior['avg_rating'] = sum(ratings) / len(ratings) if ratings else 0
+            # 3. Average rating (đã tính AVG ở bước 1)
+            if avg_rating is not None:
+                behavior['avg_rating'] = float(avg_rating)
         
         except Exception as e:
             print(f"Error analyzing user behavior: {e}")
         
-        # Cache the result
-        self._behavior_cache[cache_key] = {
-            "data": behavior,
-            "timestamp": current_time
-        }
-        
         return behavior
     
+    def precompute_user_behaviors(self, user_ids=None):
+        """
+        Tính behavior cho các user (mặc định: mọi user có watch history) và ghi vào
+        user_profiles, để analyze_user_behavior chỉ còn một SELECT theo user_id
+        Returns: số user đã ghi
+        """
+        try:
+            from app.data import db_postgresql
+        except Exception:
+            from data import db_postgresql
+        
+        if user_ids is None:
+            with db_postgresql.get_db_session() as db:
+                user_ids = db_postgresql.get_watching_user_ids(db)
+        
+        behaviors = {str(user_id): self._compute_behavior(user_id) for user_id in user_ids}
+        with db_postgresql.get_db_session() as db:
+            db_postgresql.save_user_behaviors(db, behaviors)
+        return len(behaviors)
+    
     def get_context_aware_recommendations(self, user_id, current_hour=None, n_recommendations=10):
         """
         Gợi ý phim dựa trên ngữ cảnh:
@@ -165,100 +323,117 @@ class PersonalizedRecommendationModel:
         if current_hour is None:
             current_hour = datetime.now().hour
         
-        # Analyze user behavior
-        behavior = self.analyze_user_behavior(user_id)
+        # Analyze user behavior (query DB) trên thread pool, song song với collaborative filtering
+        behavior_future = _executor.submit(self.analyze_user_behavior, user_id)
         
         # Get base recommendations from collaborative filtering (tăng lên 5x để có nhiều lựa chọn hơn)
         base_recs = self.collaborative_model.get_recommendations(user_id, n_recommendations * 5)
+        behavior = behavior_future.result()
         
         # Nếu không có collaborative recs, lấy từ content-based dựa trên thể loại yêu thích
-        if not base_recs and behavior['favorite_genres']:
-            # Lấy phim theo thể loại yêu thích
-            all_movies = self.content_based_model.movies_df
-            genre_movies = all_movies[all_movies['genres'].str.lower().str.contains(
-                '|'.join([g.lower() for g in behavior['favorite_genres'][:3]]), 
-                na=False, 
-                regex=True
-            )].sort_values('vote_average', ascending=False).head(n_recommendations * 5)
-            base_recs = genre_movies.to_dict('records')
+        genres_lower = self.content_based_model.genres_lower
+        all_movies = self.content_based_model.movies_df
+        if not base_recs and behavior['favorite_genres'] and genres_lower is not None:
+            # Lấy phim theo thể loại yêu thích: cột genres chữ thường dựng sẵn lúc build model,
+            # thể loại được escape (chuỗi genres có thể chứa ký tự đặc biệt của regex).
+            # Chỉ giữ vị trí dòng + các cột cần chấm điểm, dict chỉ dựng cho phim được trả về
+            pattern = re.compile('|'.join(re.escape(g.lower()) for g in behavior['favorite_genres'][:3]))
+            top_votes = all_movies.loc[genres_lower.str.contains(pattern, na=False), 'vote_average'].sort_values(
+                ascending=False
+            ).head(n_recommendations * 5)
+            rows = all_movies.index.get_indexer(top_votes.index)
+            positions = rows
+            ratings = top_votes.to_numpy(dtype=float)
+            years = all_movies['year'].to_numpy(dtype=float)[rows] if 'year' in all_movies.columns else np.zeros(len(rows))
+            candidate_genres = genres_lower.iloc[rows].tolist()
+        else:
+            rows = None
+            positions = self.content_based_model.movie_positions([movie.get('id') for movie in base_recs])
+            ratings = np.array([movie.get('vote_average', 0) for movie in base_recs], dtype=float)
+            years = np.array([movie.get('year', 0) for movie in base_recs], dtype=float)
+            candidate_genres = [str(movie.get('genres', '')).lower() for movie in base_recs]
+        n_candidates = len(candidate_genres)
         
-        # Score and filter based on context
-        scored_movies = []
-        for movie in base_recs:
-            score = 0
-            genre_match_count = 0
-            
-            # 1. Genre matching score (50% - tăng từ 40%)
-            movie_genres = str(movie.get('genres', '')).lower()
-            
-            # Tính điểm dựa trên số lượng thể loại khớp
-            for genre in behavior['favorite_genres']:
-                if genre.lower() in movie_genres:
-                    genre_match_count += 1
-                    # Genre weights từ behavior
-                    weight = behavior.get('genre_weights', {}).get(genre, 1)
-                    score += 0.15 * min(weight / 5, 1)  # Normalize weight
-            
-            # Bonus nếu khớp nhiều thể loại
-            if genre_match_count >= 2:
-                score += 0.2
-            elif genre_match_count >= 1:
-                score += 0.1
-            
-            # Recent genre bonus (15% - giảm từ 20%)
-            for genre in behavior['recent_genres']:
-                if genre.lower() in movie_genres:
-                    score += 0.15
-                    break
-            
-            # 2. Time of day context (10% - giảm xuống)
-            # Morning (6-12): Light, Comedy, Animation
-            # Afternoon (12-18): Action, Adventure, Family
-            # Evening (18-24): Drama, Thriller, Horror
-            # Night (0-6): Horror, Thriller, Sci-Fi
-            if 6 <= current_hour < 12:
-                if any(g in movie_genres for g in ['comedy', 'animation', 'family']):
-                    score += 0.1
-            elif 12 <= current_hour < 18:
-                if any(g in movie_genres for g in ['action', 'adventure', 'family']):
-                    score += 0.1
-            elif 18 <= current_hour < 24:
-                if any(g in movie_genres for g in ['drama', 'thriller', 'horror', 'romance']):
-                    score += 0.1
-            else:  # 0-6
-                if any(g in movie_genres for g in ['horror', 'thriller', 'sci-fi']):
-                    score += 0.1
-            
-            # 3. Rating score (15% - giảm từ 20%)
-            movie_rating = movie.get('vote_average', 0)
-            if movie_rating >= 8.0:
-                score += 0.15
-            elif movie_rating >= 7.0:
-                score += 0.1
-            elif movie_rating >= 6.0:
-                score += 0.05
-            
-            # 4. Decade preference (10% bonus)
-            movie_year = movie.get('year', 0)
-            if behavior['preferred_decade'] and movie_year:
-                decade = (movie_year // 10) * 10
-                if abs(decade - behavior['preferred_decade']) <= 10:
-                    score += 0.1
-            
-            scored_movies.append((movie, score))
+        # Score and filter based on context: so khớp thể loại vectorized trên cả tập ứng viên,
+        # cộng điểm trong kernel (numba nếu có)
+        # Thể loại trong GENRE_BITS: AND với bitmask dựng sẵn của content-based model; thể loại khác
+        # (hoặc phim không có trong movies_df) thì so chuỗi genres như cũ
+        genre_bits = self.content_based_model.genre_bits
+        known = positions >= 0 if genre_bits is not None else np.zeros(n_candidates, dtype=bool)
+        movie_bits = np.where(known, genre_bits[positions], 0) if known.any() else np.zeros(n_candidates, dtype=np.uint32)
+        movie_genres = None
+        genre_matches = {}  # genre -> mảng bool; favorite/recent genres thường trùng nhau nên chỉ so chuỗi một lần
+        
+        def contains(genre):
+            nonlocal movie_genres
+            if genre not in genre_matches:
+                if movie_genres is None:
+                    movie_genres = pd.Series(candidate_genres, dtype=object)
+                genre_matches[genre] = movie_genres.str.contains(genre, regex=False).to_numpy(dtype=bool)
+            return genre_matches[genre]
+        
+        def matches_any(genres):
+            matched = np.zeros(n_candidates, dtype=bool)
+            for genre in genres:
+                bit = GENRE_BITS.get(genre)
+                if bit is None:
+                    matched |= contains(genre)
+                elif known.all():
+                    matched |= (movie_bits & bit) != 0
+                else:
+                    matched |= np.where(known, (movie_bits & bit) != 0, contains(genre))
+            return matched
         
-        # Lọc bỏ phim có điểm quá thấp (score < 0.2)
-        scored_movies = [(movie, score) for movie, score in scored_movies if score >= 0.2]
+        # 1. Genre matching (thể loại yêu thích, có trọng số) + recent genre bonus
+        favorite_genres = behavior['favorite_genres']
+        fav_match = np.zeros((n_candidates, len(favorite_genres)), dtype=bool)
+        for j, genre in enumerate(favorite_genres):
+            fav_match[:, j] = matches_any([genre.lower()])
+        genre_weights = behavior.get('genre_weights', {})
+        fav_weights = [genre_weights.get(genre, 1) for genre in favorite_genres]
+        recent_match = matches_any([genre.lower() for genre in behavior['recent_genres']])
         
-        # Sort by score
-        scored_movies.sort(key=lambda x: x[1], reverse=True)
+        # 2. Time of day context
+        tod_match = matches_any(time_of_day_genres(current_hour))
+        
+        # 3. Rating score, 4. Decade preference (ratings/years ở trên)
+        scores = context_scores(fav_match, fav_weights, recent_match, tod_match,
+                                ratings, years, behavior['preferred_decade'])
+        
+        # Lọc bỏ phim có điểm quá thấp (score < 0.2). Chỉ lấy top n*3 theo score (heap, không sort hết);
+        # chỉ khi diversity không chọn đủ n phim từ đó mới sắp xếp toàn bộ rồi chọn lại
+        kept = np.flatnonzero(scores >= 0.2)
+        kept_scores = scores[kept]
+        n_top = min(len(kept), n_recommendations * 3)
+        ranked = kept[topk_scores(kept_scores, n_top)]
+        chosen = self._diversify(ranked, candidate_genres, n_recommendations)
+        if len(chosen) < n_recommendations and n_top < len(kept):
+            ranked = kept[topk_scores(kept_scores, len(kept))]
+            chosen = self._diversify(ranked, candidate_genres, n_recommendations)
+        
+        # Nếu không đủ phim, thêm phim có score cao nhất vào
+        if len(chosen) < n_recommendations:
+            chosen_set = set(chosen)
+            remaining = [int(i) for i in ranked if i not in chosen_set]
+            chosen.extend(remaining[:n_recommendations - len(chosen)])
+        chosen = chosen[:n_recommendations]
         
-        # Đảm bảo diversity - không lấy quá nhiều phim cùng thể loại
+        if rows is not None:
+            return all_movies.iloc[rows[chosen]].to_dict('records')
+        return [base_recs[i] for i in chosen]
+    
+    @staticmethod
+    def _diversify(ranked, candidate_genres, n_recommendations):
+        """
+        Đảm bảo diversity - không lấy quá nhiều phim cùng thể loại (max 3 phim/thể loại):
+        duyệt `ranked` (index ứng viên theo thứ tự score), dừng khi đủ n_recommendations phim.
+        candidate_genres[i]: chuỗi genres chữ thường của ứng viên i. Trả về list index được chọn.
+        """
         diverse_movies = []
         genre_count = {}
         
-        for movie, score in scored_movies:
-            movie_genres = str(movie.get('genres', '')).lower().split('|')
+        for i in ranked:
+            movie_genres = candidate_genres[i].split('|')
             
             # Kiểm tra xem có thể thêm phim này không (max 3 phim/thể loại)
             can_add = True
@@ -269,7 +444,7 @@ class PersonalizedRecommendationModel:
                     break
             
             if can_add:
-                diverse_movies.append(movie)
+                diverse_movies.append(int(i))
                 # Update genre count
                 for genre in movie_genres:
                     genre = genre.strip()
@@ -279,12 +454,7 @@ class PersonalizedRecommendationModel:
                 if len(diverse_movies) >= n_recommendations:
                     break
         
-        # Nếu không đủ phim, thêm phim có score cao nhất vào
-        if len(diverse_movies) < n_recommendations:
-            remaining = [m for m, s in scored_movies if m not in diverse_movies]
-            diverse_movies.extend(remaining[:n_recommendations - len(diverse_movies)])
-        
-        return diverse_movies[:n_recommendations]
+        return diverse_movies
     
     def get_personalized_recommendations(self, user_id, n_recommendations=10):
         """
@@ -297,7 +467,40 @@ class PersonalizedRecommendationModel:
         current_hour = datetime.now().hour
         return self.get_context_aware_recommendations(user_id, current_hour, n_recommendations)
     
+    def invalidate_behavior(self, user_id=None):
+        """Bỏ behavior đã cache của một user (vừa xem/đánh giá phim), hoặc của tất cả nếu user_id=None"""
+        with self._behavior_cache_lock:
+            if user_id is None:
+                self._behavior_cache.clear()
+            else:
+                self._behavior_cache.pop(f"behavior_{user_id}", None)
+        
+        shared = self._shared_cache()
+        if shared is not None:
+            try:
+                if user_id is None:
+                    keys = list(shared.scan_iter(match="behavior:*", count=500))
+                    if keys:
+                        shared.delete(*keys)
+                else:
+                    shared.delete(f"behavior:{user_id}")
+            except Exception as e:
+                self._redis_unavailable(e)
+        
+        # Profile tính sẵn của user cũng đã cũ (refresh toàn bộ thì không đụng: behavior không phụ thuộc model)
+        if user_id is not None:
+            try:
+                try:
+                    from app.data import db_postgresql
+                except Exception:
+                    from data import db_postgresql
+                with db_postgresql.get_db_session() as db:
+                    db_postgresql.clear_user_behavior(db, str(user_id))
+            except Exception:
+                pass
+    
     def refresh(self):
         """Refresh underlying models."""
+        self.invalidate_behavior()
         self.collaborative_model.refresh()
         return True
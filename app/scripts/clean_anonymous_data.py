@@ -9,20 +9,33 @@ import os
 # Add parent directory to path
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from sqlalchemy import select, func, text
+
 from data.db_postgresql import get_db_session
-from data.models import WatchHistory, Watchlist, User
+from data.models import WatchHistory, Watchlist, User, user_pk
+
+# Xóa watch history + watchlist của một user trong một câu lệnh (một round trip, không load ORM object)
+DELETE_USER_DATA_SQL = text("""
+    WITH target AS (SELECT id FROM users WHERE user_id = :user_id),
+    deleted_history AS (
+        DELETE FROM watch_history WHERE user_pk IN (SELECT id FROM target) RETURNING 1
+    ),
+    deleted_watchlist AS (
+        DELETE FROM watchlist WHERE user_pk IN (SELECT id FROM target) RETURNING 1
+    )
+    SELECT (SELECT count(*) FROM deleted_history), (SELECT count(*) FROM deleted_watchlist)
+""")
 
 def clean_anonymous_data():
     """Xóa tất cả dữ liệu của Anonymous users"""
     with get_db_session() as db:
-        # Count records before deletion
-        watch_history_count = db.query(WatchHistory).filter(
-            WatchHistory.user_id == 'Anonymous'
-        ).count()
-        
-        watchlist_count = db.query(Watchlist).filter(
-            Watchlist.user_id == 'Anonymous'
-        ).count()
+        # Count records before deletion (cả hai bảng trong một query)
+        watch_history_count, watchlist_count = db.execute(select(
+            select(func.count()).select_from(WatchHistory)
+            .where(WatchHistory.user_pk == user_pk('Anonymous')).scalar_subquery(),
+            select(func.count()).select_from(Watchlist)
+            .where(Watchlist.user_pk == user_pk('Anonymous')).scalar_subquery(),
+        )).one()
         
         print(f"\n🔍 Found:")
         print(f"   - {watch_history_count} watch history records for Anonymous")
@@ -38,15 +51,10 @@ def clean_anonymous_data():
             print("❌ Cancelled.")
             return
         
-        # Delete watch history
-        deleted_history = db.query(WatchHistory).filter(
-            WatchHistory.user_id == 'Anonymous'
-        ).delete()
-        
-        # Delete watchlist
-        deleted_watchlist = db.query(Watchlist).filter(
-            Watchlist.user_id == 'Anonymous'
-        ).delete()
+        # Delete watch history + watchlist
+        deleted_history, deleted_watchlist = db.execute(
+            DELETE_USER_DATA_SQL, {'user_id': 'Anonymous'}
+        ).one()
         
         db.commit()
         
@@ -58,8 +66,18 @@ def clean_anonymous_data():
 def show_anonymous_users():
     """Hiển thị tất cả users có tên Anonymous hoặc tương tự"""
     with get_db_session() as db:
-        users = db.query(User).filter(
-            User.user_id.ilike('%anonymous%')
+        # Số watch history / watchlist của từng user tính trong cùng một query (không N+1)
+        watch_count = (
+            select(func.count()).select_from(WatchHistory)
+            .where(WatchHistory.user_pk == User.id).scalar_subquery()
+        )
+        watchlist_count = (
+            select(func.count()).select_from(Watchlist)
+            .where(Watchlist.user_pk == User.id).scalar_subquery()
+        )
+        users = db.execute(
+            select(User.user_id, User.created_at, watch_count, watchlist_count)
+            .where(User.user_id.ilike('%anonymous%'))
         ).all()
         
         if not users:
@@ -67,18 +85,11 @@ def show_anonymous_users():
             return
         
         print(f"\n📋 Found {len(users)} Anonymous-like users:")
-        for user in users:
-            watch_count = db.query(WatchHistory).filter(
-                WatchHistory.user_id == user.user_id
-            ).count()
-            watchlist_count = db.query(Watchlist).filter(
-                Watchlist.user_id == user.user_id
-            ).count()
-            
-            print(f"\n   User: {user.user_id}")
+        for user_id, created_at, watch_count, watchlist_count in users:
+            print(f"\n   User: {user_id}")
             print(f"   - Watch history: {watch_count} items")
             print(f"   - Watchlist: {watchlist_count} items")
-            print(f"   - Created: {user.created_at}")
+            print(f"   - Created: {created_at}")
 
 if __name__ == "__main__":
     print("=" * 60)
@@ -0,0 +1,383 @@
+"""
+Migration script to bring an existing database in line with the
+indexes, constraints and column defaults declared in data/models.py
+(create_all() only creates missing tables, it never alters existing ones)
+Safe to run multiple times
+"""
+import sys
+import os
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateTable, CreateIndex
+from data.db_postgresql import engine, USER_EVENT_PARTITIONS_SQL
+from data.models import (
+    UserEvent, PGVECTOR_AVAILABLE, USER_EMBEDDING_DIM,
+    EventType, EventCategory, FeedbackType, ModelType,
+)
+
+# Rows reference users/movies by integer primary key instead of the external
+# string ids: (table, old string column, new key column, referenced table)
+SURROGATE_KEYS = [
+    ("ratings", "user_id", "user_pk", "users"),
+    ("ratings", "movie_id", "movie_pk", "movies"),
+    ("reviews", "user_id", "user_pk", "users"),
+    ("reviews", "movie_id", "movie_pk", "movies"),
+    ("watch_history", "user_id", "user_pk", "users"),
+    ("watch_history", "movie_id", "movie_pk", "movies"),
+    ("watchlist", "user_id", "user_pk", "users"),
+    ("watchlist", "movie_id", "movie_pk", "movies"),
+]
+
+# Backfill the key from the old column, then drop the old column (its indexes and
+# the old movie_stats view that depends on it go with it)
+SURROGATE_KEY_SQL = """
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = current_schema()
+          AND table_name = '{table}' AND column_name = '{column}'
+    ) THEN
+        DROP MATERIALIZED VIEW IF EXISTS movie_stats;
+        ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {key} INTEGER REFERENCES {ref_table}(id);
+        UPDATE {table} t SET {key} = r.id FROM {ref_table} r WHERE r.{column} = t.{column};
+        ALTER TABLE {table} ALTER COLUMN {key} SET NOT NULL;
+        ALTER TABLE {table} DROP COLUMN {column};
+    END IF;
+END $$
+"""
+
+# user_events becomes a monthly range-partitioned table: the plain table is set
+# aside (its indexes/constraints dropped so the names can be reused), the
+# partitioned table is created from the model, then the rows are copied over
+UNPARTITION_USER_EVENTS_SQL = """
+DO $$
+DECLARE
+    obj RECORD;
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM pg_class
+        WHERE relname = 'user_events' AND relkind = 'r'
+          AND relnamespace = current_schema()::regnamespace
+    ) THEN
+        ALTER TABLE user_events RENAME TO user_events_unpartitioned;
+        ALTER SEQUENCE IF EXISTS user_events_id_seq RENAME TO user_events_unpartitioned_id_seq;
+        FOR obj IN SELECT conname FROM pg_constraint WHERE conrelid = 'user_events_unpartitioned'::regclass LOOP
+            EXECUTE format('ALTER TABLE user_events_unpartitioned DROP CONSTRAINT %I', obj.conname);
+        END LOOP;
+        FOR obj IN SELECT indexrelid::regclass AS name FROM pg_index WHERE indrelid = 'user_events_unpartitioned'::regclass LOOP
+            EXECUTE format('DROP INDEX %s', obj.name);
+        END LOOP;
+    END IF;
+END $$
+"""
+
+USER_EVENT_COLUMNS = ", ".join(c.name for c in UserEvent.__table__.columns)
+
+COPY_USER_EVENTS_SQL = f"""
+DO $$
+BEGIN
+    IF to_regclass('user_events_unpartitioned') IS NOT NULL THEN
+        INSERT INTO user_events ({USER_EVENT_COLUMNS})
+        SELECT {USER_EVENT_COLUMNS} FROM user_events_unpartitioned;
+        PERFORM setval(pg_get_serial_sequence('user_events', 'id'), (SELECT MAX(id) FROM user_events));
+        DROP TABLE user_events_unpartitioned;
+    END IF;
+END $$
+"""
+
+# Chỉ đổi kiểu khi user_embedding chưa là vector (chạy lại không rewrite bảng / build lại HNSW)
+VECTOR_EMBEDDING_SQL = f"""
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'user_profiles' AND column_name = 'user_embedding'
+          AND udt_name <> 'vector'
+    ) THEN
+        ALTER TABLE user_profiles ALTER COLUMN user_embedding TYPE vector({USER_EMBEDDING_DIM})
+            USING user_embedding::text::vector({USER_EMBEDDING_DIM});
+    END IF;
+END $$
+"""
+
+# (description, SQL or list of SQL) - executed in order, each statement must be idempotent.
+# One command per statement: psycopg prepares every query, and a prepared
+# statement cannot hold several commands
+# (table, column, enum) chuyển VARCHAR -> SMALLINT code
+ENUM_CODE_COLUMNS = [
+    ("user_events", "event_type", EventType),
+    ("user_events", "event_category", EventCategory),
+    ("recommendation_cache", "model_type", ModelType),
+    ("recommendation_feedback", "feedback_type", FeedbackType),
+    ("recommendation_feedback", "model_type", ModelType),
+    ("model_performance", "model_type", ModelType),
+]
+
+# Chỉ chạy khi cột vẫn là VARCHAR; giá trị không nhận ra -> 0 (OTHER)
+ENUM_CODE_SQL = """
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = '{table}' AND column_name = '{column}'
+          AND data_type = 'character varying'
+    ) THEN
+        ALTER TABLE {table} ALTER COLUMN {column} TYPE SMALLINT USING (
+            CASE WHEN {column} IS NULL THEN NULL
+                 {cases}
+                 ELSE 0 END
+        );
+    END IF;
+END $$
+"""
+
+
+def enum_code_sql(table, column, enum_class):
+    cases = " ".join(
+        f"WHEN lower({column}) = '{member.name.lower()}' THEN {int(member)}"
+        for member in enum_class
+    )
+    return ENUM_CODE_SQL.format(table=table, column=column, cases=cases)
+
+
+MIGRATIONS = [
+    (
+        "Switch user/movie references to integer keys",
+        [
+            SURROGATE_KEY_SQL.format(table=table, column=column, key=key, ref_table=ref_table)
+            for table, column, key, ref_table in SURROGATE_KEYS
+        ] + [
+            "CREATE INDEX IF NOT EXISTS idx_user_movie_rating ON ratings (user_pk, movie_pk)",
+            "CREATE INDEX IF NOT EXISTS ix_ratings_movie_pk ON ratings (movie_pk)",
+            "CREATE INDEX IF NOT EXISTS idx_movie_timestamp ON reviews (movie_pk, timestamp)",
+            "CREATE INDEX IF NOT EXISTS ix_reviews_user_pk ON reviews (user_pk)",
+            "CREATE INDEX IF NOT EXISTS idx_user_watched ON watch_history (user_pk, watched_at)",
+            "CREATE INDEX IF NOT EXISTS ix_watch_history_movie_pk ON watch_history (movie_pk)",
+            "CREATE INDEX IF NOT EXISTS ix_watchlist_movie_pk ON watchlist (movie_pk)",
+        ],
+    ),
+    (
+        "Remove duplicate watchlist rows",
+        """
+        DELETE FROM watchlist a
+        USING watchlist b
+        WHERE a.user_pk = b.user_pk
+          AND a.movie_pk = b.movie_pk
+          AND a.id > b.id
+        """,
+    ),
+    (
+        "Make idx_user_movie_watchlist UNIQUE (needed for ON CONFLICT)",
+        """
+        DO $$
+        BEGIN
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_constraint WHERE conname = 'idx_user_movie_watchlist'
+            ) THEN
+                DROP INDEX IF EXISTS idx_user_movie_watchlist;
+                ALTER TABLE watchlist
+                    ADD CONSTRAINT idx_user_movie_watchlist UNIQUE (user_pk, movie_pk);
+            END IF;
+        END $$
+        """,
+    ),
+    (
+        "Move timestamp defaults to the database (UTC)",
+        [
+            f"ALTER TABLE {table} ALTER COLUMN {column} SET DEFAULT timezone('utc', now())"
+            for table, column in [
+                ("users", "created_at"),
+                ("users", "updated_at"),
+                ("movies", "created_at"),
+                ("movies", "updated_at"),
+                ("ratings", "timestamp"),
+                ("reviews", "timestamp"),
+                ("watch_history", "watched_at"),
+                ("watchlist", "added_at"),
+                ("user_profiles", "first_seen"),
+                ("user_profiles", "updated_at"),
+                ("recommendation_cache", "created_at"),
+                ("recommendation_feedback", "timestamp"),
+                ("model_performance", "evaluation_date"),
+                ("ab_tests", "created_at"),
+                ("ab_tests", "updated_at"),
+            ]
+        ],
+    ),
+    (
+        "Drop single-column indexes covered by a composite index prefix",
+        [
+            f"DROP INDEX IF EXISTS {index}"
+            for index in [
+                "ix_ratings_user_id",
+                "ix_reviews_movie_id",
+                "ix_watch_history_user_id",
+                "ix_watchlist_user_id",
+            ]
+        ],
+    ),
+    (
+        "Replace B-tree timestamp indexes on append-only tables with BRIN",
+        [
+            f"CREATE INDEX IF NOT EXISTS {index} ON {table} USING brin ({column}) WITH (pages_per_range = 32)"
+            for index, table, column in [
+                ("idx_rating_timestamp_brin", "ratings", "timestamp"),
+                ("idx_watch_history_watched_brin", "watch_history", "watched_at"),
+                ("idx_event_timestamp_brin", "user_events", "timestamp"),
+                ("idx_feedback_timestamp_brin", "recommendation_feedback", "timestamp"),
+            ]
+        ] + [
+            f"DROP INDEX IF EXISTS {index}"
+            for index in [
+                "ix_ratings_timestamp",
+                "ix_watch_history_watched_at",
+                "ix_user_events_timestamp",
+                "ix_recommendation_feedback_timestamp",
+            ]
+        ],
+    ),
+    (
+        "Store JSON columns as JSONB and index the genre lookups",
+        [
+            f"ALTER TABLE {table} ALTER COLUMN {column} TYPE JSONB USING {column}::jsonb"
+            for table, column in [
+                ("movies", "genres"),
+                ("movies", "cast_data"),
+                ("user_events", "event_metadata"),
+                ("user_events", "geo_location"),
+                ("user_profiles", "genre_preferences"),
+                ("user_profiles", "actor_preferences"),
+                ("user_profiles", "director_preferences"),
+                ("user_profiles", "preferred_watch_hours"),
+                ("user_profiles", "preferred_watch_days"),
+                ("recommendation_cache", "context"),
+                ("recommendation_cache", "recommendations"),
+                ("ab_tests", "control_metrics"),
+                ("ab_tests", "treatment_metrics"),
+            ] + ([] if PGVECTOR_AVAILABLE else [("user_profiles", "user_embedding")])
+        ] + [
+            "CREATE INDEX IF NOT EXISTS idx_movie_genres_gin ON movies USING gin (genres)",
+            "CREATE INDEX IF NOT EXISTS idx_profile_genres_gin ON user_profiles USING gin (genre_preferences)",
+        ],
+    ),
+    (
+        "Partition user_events by month",
+        [
+            UNPARTITION_USER_EVENTS_SQL,
+        ] + [
+            # Bảng mới tạo từ model (cột SMALLINT): đổi cột của bảng cũ trước khi copy
+            enum_code_sql("user_events_unpartitioned", column, enum_class)
+            for table, column, enum_class in ENUM_CODE_COLUMNS if table == "user_events"
+        ] + [
+            str(CreateTable(UserEvent.__table__, if_not_exists=True).compile(dialect=postgresql.dialect())),
+        ] + [
+            str(CreateIndex(index, if_not_exists=True).compile(dialect=postgresql.dialect()))
+            for index in UserEvent.__table__.indexes
+        ] + USER_EVENT_PARTITIONS_SQL + [
+            COPY_USER_EVENTS_SQL,
+        ],
+    ),
+    *([(
+        "Store user_embedding as a pgvector column with an HNSW index",
+        [
+            "CREATE EXTENSION IF NOT EXISTS vector",
+            VECTOR_EMBEDDING_SQL,
+            "CREATE INDEX IF NOT EXISTS idx_user_embedding_hnsw ON user_profiles "
+            "USING hnsw (user_embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64)",
+        ],
+    )] if PGVECTOR_AVAILABLE else []),
+    (
+        "Drop unused int8 copy of user_embedding",
+        [
+            "ALTER TABLE user_profiles DROP COLUMN IF EXISTS user_embedding_q",
+            "ALTER TABLE user_profiles DROP COLUMN IF EXISTS user_embedding_scale",
+        ],
+    ),
+    (
+        "Cover the per-user watch history lookup with (user_pk, watched_at) INCLUDE (movie_pk)",
+        [
+            "CREATE INDEX IF NOT EXISTS idx_user_watched_covering ON watch_history "
+            "(user_pk, watched_at) INCLUDE (movie_pk)",
+            "DROP INDEX IF EXISTS idx_user_watched",
+        ],
+    ),
+    (
+        "Add precomputed behavior to user_profiles",
+        [
+            "ALTER TABLE user_profiles ADD COLUMN IF NOT EXISTS behavior JSON",
+            "ALTER TABLE user_profiles ADD COLUMN IF NOT EXISTS behavior_updated_at TIMESTAMP WITHOUT TIME ZONE",
+        ],
+    ),
+    (
+        "Replace cache_key / profile user_id unique indexes with covering ones",
+        [
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_cache_covering ON recommendation_cache "
+            "(cache_key) INCLUDE (expires_at, model_version)",
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_profile_user_covering ON user_profiles "
+            "(user_id) INCLUDE (genre_preferences, cluster_id)",
+            "DROP INDEX IF EXISTS ix_recommendation_cache_cache_key",
+            "DROP INDEX IF EXISTS ix_user_profiles_user_id",
+        ],
+    ),
+    (
+        "Drop indexes duplicated by the primary key or a composite index prefix",
+        [
+            f"DROP INDEX IF EXISTS ix_{table}_id"
+            for table in [
+                "users", "movies", "ratings", "reviews", "watch_history", "watchlist",
+                "user_events", "user_profiles", "recommendation_cache",
+                "recommendation_feedback", "model_performance", "ab_tests", "user_consents",
+            ]
+        ] + [
+            f"DROP INDEX IF EXISTS {index}"
+            for index in [
+                "ix_movies_year",
+                "ix_movies_popularity",
+                "ix_user_events_user_id",
+                "ix_user_events_session_id",
+                "ix_user_events_movie_id",
+                "ix_user_events_event_type",
+                "ix_recommendation_cache_user_id",
+                "ix_recommendation_cache_expires_at",
+                "ix_recommendation_feedback_user_id",
+                "ix_recommendation_feedback_recommendation_id",
+                "ix_model_performance_model_type",
+            ]
+        ],
+    ),
+    (
+        "Store low-cardinality categoricals as SMALLINT codes",
+        [enum_code_sql(table, column, enum_class) for table, column, enum_class in ENUM_CODE_COLUMNS],
+    ),
+    (
+        "Drop unused movie_stats materialized view",
+        "DROP MATERIALIZED VIEW IF EXISTS movie_stats",
+    ),
+]
+
+
+def apply_migrations():
+    """Run every statement in MIGRATIONS inside a single transaction"""
+    try:
+        with engine.begin() as conn:
+            for description, sql in MIGRATIONS:
+                print(f"→ {description}...")
+                for statement in ([sql] if isinstance(sql, str) else sql):
+                    conn.execute(text(statement))
+        print("✅ All migrations applied!")
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        raise
+
+
+if __name__ == "__main__":
+    print("=" * 50)
+    print("Database Migration: Performance Schema")
+    print("=" * 50)
+    apply_migrations()
+    print("\n✅ Migration completed!")
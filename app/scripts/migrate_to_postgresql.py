@@ -145,6 +145,10 @@ def migrate_ratings(data_dir: str):
         batch_size = 5000
         total_inserted = 0
         
+        # Reference users/movies by integer key: resolve once up front
+        user_pks = dict(db.query(User.user_id, User.id))
+        movie_pks = dict(db.query(Movie.movie_id, Movie.id))
+        
         for start in range(0, len(df), batch_size):
             batch = df.iloc[start:start + batch_size]
             ratings_to_insert = []
@@ -156,8 +160,8 @@ def migrate_ratings(data_dir: str):
                     movie_id = str(int(float(row['movieId'])))
                     
                     rating = Rating(
-                        user_id=user_id,
-                        movie_id=movie_id,
+                        user_pk=user_pks[user_id],
+                        movie_pk=movie_pks[movie_id],
                         rating=float(row['rating']),
                         timestamp=datetime.fromtimestamp(int(row['timestamp'])) if pd.notna(row.get('timestamp')) else datetime.utcnow()
                     )
@@ -199,6 +203,10 @@ def migrate_reviews(data_dir: str):
         batch_size = 1000
         total_inserted = 0
         
+        # Reference users/movies by integer key: resolve once up front
+        user_pks = dict(db.query(User.user_id, User.id))
+        movie_pks = dict(db.query(Movie.movie_id, Movie.id))
+        
         for start in range(0, len(df), batch_size):
             batch = df.iloc[start:start + batch_size]
             reviews_to_insert = []
@@ -206,8 +214,8 @@ def migrate_reviews(data_dir: str):
             for _, row in batch.iterrows():
                 try:
                     review = Review(
-                        movie_id=str(int(float(row['movieId']))),
-                        user_id=str(int(float(row['userId']))),
+                        movie_pk=movie_pks[str(int(float(row['movieId'])))],
+                        user_pk=user_pks[str(int(float(row['userId'])))],
                         username=row.get('username', 'Anonymous'),
                         rating=int(row['rating']),
                         review_text=row.get('review', ''),
@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+"""
+Tính sẵn top-N collaborative recommendations cho mọi user và lưu vào
+RecommendationCache (hết hạn sau 6 giờ). Chạy định kỳ (cron) để request
+chỉ còn đọc một dòng theo cache_key thay vì tính lại.
+"""
+import sys
+import os
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.collaborative_model import CollaborativeModel
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+
+def precompute_recommendations():
+    """Ghi top-N của tất cả user có rating vào RecommendationCache"""
+    print("🔄 Precomputing collaborative recommendations...")
+    model = CollaborativeModel(data_dir=DATA_DIR)
+    count = model.precompute_user_recommendations()
+    print(f"✅ Cached recommendations for {count} users")
+
+
+if __name__ == "__main__":
+    precompute_recommendations()
@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+"""
+Tính sẵn behavior (favorite_genres, genre_weights, preferred_decade, ...) cho
+mọi user có watch history và lưu vào user_profiles. Chạy hằng đêm (cron) để
+analyze_user_behavior chỉ còn một SELECT theo user_id thay vì tính lại.
+"""
+import sys
+import os
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.personalized_model import PersonalizedRecommendationModel
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+
+def precompute_user_behavior():
+    """Ghi behavior của tất cả user có watch history vào user_profiles"""
+    print("🔄 Precomputing user behavior profiles...")
+    model = PersonalizedRecommendationModel(data_dir=DATA_DIR)
+    count = model.precompute_user_behaviors()
+    print(f"✅ Stored behavior for {count} users")
+
+
+if __name__ == "__main__":
+    precompute_user_behavior()
@@ -11,7 +11,7 @@ from collections import defaultdict
 
 from data.models import (
     Rating, UserEvent, RecommendationFeedback,
-    ModelPerformance, Movie
+    ModelPerformance, Movie, user_pk
 )
 
 
@@ -392,9 +392,9 @@ class RecommendationEvaluationService:
         Use future interactions as ground truth
         """
         # Get recent high-rated movies as ground truth
-        recent = self.db.query(Rating).filter(
+        recent = self.db.query(Movie.movie_id).join(Rating.movie).filter(
             and_(
-                Rating.user_id == user_id,
+                Rating.user_pk == user_pk(user_id),
                 Rating.rating >= 4.0
             )
         ).order_by(Rating.timestamp.desc()).limit(10).all()
@@ -14,6 +14,7 @@ from data.models import (
     UserEvent, UserProfile, RecommendationFeedback,
     UserConsent, User
 )
+from data.bulk import bulk_insert_events
 
 
 class EventTrackingService:
@@ -95,13 +96,43 @@ class EventTrackingService:
         
         self.db.add(event)
         self.db.commit()
-        self.db.refresh(event)
         
         # Async update user profile (trong production nên dùng queue)
         self._update_user_profile_async(user_id)
         
         return event
     
+    def track_events(self, events: List[Dict[str, Any]]) -> int:
+        """
+        Track nhiều events một lần (batch từ client / import)
+        Mỗi dict có cùng key như tham số của track_event (metadata -> event_metadata).
+        Insert bằng 1 executemany thay vì 1 INSERT mỗi event.
+        """
+        consent = {}
+        rows = []
+        for event in events:
+            user_id = event['user_id']
+            if user_id not in consent:
+                consent[user_id] = self._check_consent(user_id)
+            if not consent[user_id]:
+                continue
+            
+            row = dict(event)
+            row['event_metadata'] = row.pop('metadata', None) or {}
+            row['event_category'] = 'explicit' if row['event_type'] in self.EXPLICIT_EVENTS else 'implicit'
+            row['session_id'] = row.get('session_id') or self._generate_session_id(user_id)
+            if row.get('ip_address'):
+                row['ip_address'] = self._anonymize_ip(row['ip_address'])
+            rows.append(row)
+        
+        inserted = bulk_insert_events(self.db, rows)
+        self.db.commit()
+        
+        for user_id in {row['user_id'] for row in rows}:
+            self._update_user_profile_async(user_id)
+        
+        return inserted
+    
     def track_view(self, user_id: str, movie_id: str, **kwargs) -> UserEvent:
         """Track movie view event"""
         return self.track_event(
@@ -292,7 +323,6 @@ class EventTrackingService:
         profile.version += 1
         
         self.db.commit()
-        self.db.refresh(profile)
         
         return profile
     
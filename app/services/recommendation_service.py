@@ -7,17 +7,17 @@ import numpy as np
 import pandas as pd
 from typing import List, Dict, Optional, Tuple
 from datetime import datetime, timedelta
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, selectinload
 from sqlalchemy import func, and_, or_
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.preprocessing import MinMaxScaler
+from sklearn.preprocessing import MinMaxScaler, normalize
 import json
 
 from data.models import (
-    Movie, Rating, UserEvent, UserProfile,
-    WatchHistory, RecommendationCache
+    Movie, User, Rating, UserEvent, UserProfile,
+    WatchHistory, RecommendationCache, user_pk
 )
+from models._kernels import topk_scores
 
 
 class AdvancedRecommendationService:
@@ -115,7 +115,8 @@ class AdvancedRecommendationService:
             ngram_range=(1, 2)
         )
         
-        self.movie_features = self.tfidf.fit_transform(texts)
+        # Hàng chuẩn hóa L2: cosine similarity = một phép nhân ma trận thưa
+        self.movie_features = normalize(self.tfidf.fit_transform(texts), norm='l2', copy=False)
         self.movie_id_to_index = {mid: i for i, mid in enumerate(movie_ids)}
     
     def _find_similar_movies(
@@ -131,11 +132,12 @@ class AdvancedRecommendationService:
         idx = self.movie_id_to_index[movie_id]
         movie_vector = self.movie_features[idx]
         
-        # Calculate similarities
-        similarities = cosine_similarity(movie_vector, self.movie_features).flatten()
+        # Calculate similarities (features đã chuẩn hóa L2)
+        similarities = (self.movie_features @ movie_vector.T).toarray().ravel()
         
-        # Get top similar (excluding self)
-        similar_indices = similarities.argsort()[::-1][1:n+100]
+        # Get top similar (excluding self), không sort toàn bộ catalog
+        similar_indices = topk_scores(similarities, n + 100)
+        similar_indices = similar_indices[similar_indices != idx][:n + 99]
         
         # Get movies
         movies = self.db.query(Movie).all()
@@ -176,7 +178,7 @@ class AdvancedRecommendationService:
         """
         # Get user ratings
         user_ratings = self.db.query(Rating).filter(
-            Rating.user_id == user_id
+            Rating.user_pk == user_pk(user_id)
         ).all()
         
         if not user_ratings:
@@ -192,7 +194,10 @@ class AdvancedRecommendationService:
         """User-based collaborative filtering"""
         # Get all ratings
         ratings_data = []
-        for rating in self.db.query(Rating).all():
+        all_ratings = self.db.query(
+            User.user_id, Movie.movie_id, Rating.rating
+        ).select_from(Rating).join(Rating.user).join(Rating.movie)
+        for rating in all_ratings:
             ratings_data.append({
                 'user_id': rating.user_id,
                 'movie_id': rating.movie_id,
@@ -215,32 +220,29 @@ class AdvancedRecommendationService:
         if user_id not in user_item_matrix.index:
             return []
         
-        # Calculate user similarities
-        user_vector = user_item_matrix.loc[user_id].values.reshape(1, -1)
-        similarities = cosine_similarity(user_vector, user_item_matrix.values).flatten()
+        # Calculate user similarities: chuẩn hóa hàng một lần rồi nhân ma trận
+        self_idx = user_item_matrix.index.get_loc(user_id)
+        normalized = normalize(user_item_matrix.to_numpy(dtype=np.float64), norm='l2')
+        similarities = normalized @ normalized[self_idx]
         
         # Find similar users (excluding self)
-        similar_user_indices = similarities.argsort()[::-1][1:21]
+        similar_user_indices = topk_scores(similarities, 21)
+        similar_user_indices = similar_user_indices[similar_user_indices != self_idx][:20]
         similar_users = user_item_matrix.index[similar_user_indices].tolist()
         
         # Get movies rated by similar users but not by target user
         user_movies = set(df[df['user_id'] == user_id]['movie_id'].values)
         
-        candidate_movies = {}
-        for sim_user in similar_users:
-            sim_user_movies = df[df['user_id'] == sim_user]
-            for _, row in sim_user_movies.iterrows():
-                movie_id = row['movie_id']
-                if movie_id not in user_movies:
-                    if movie_id not in candidate_movies:
-                        candidate_movies[movie_id] = []
-                    candidate_movies[movie_id].append(row['rating'])
+        # Một lần lọc + groupby thay vì lọc df và iterrows cho từng similar user;
+        # thứ tự ứng viên giữ như cũ (theo thứ hạng similar user, rồi thứ tự rating)
+        candidates = df[df['user_id'].isin(similar_users) & ~df['movie_id'].isin(user_movies)]
+        user_rank = {sim_user: rank for rank, sim_user in enumerate(similar_users)}
+        candidates = candidates.assign(_rank=candidates['user_id'].map(user_rank))
+        candidates = candidates.sort_values('_rank', kind='stable')
+        stats = candidates.groupby('movie_id', sort=False)['rating'].agg(['mean', 'count'])
         
         # Calculate predicted ratings
-        movie_scores = []
-        for movie_id, ratings in candidate_movies.items():
-            avg_rating = np.mean(ratings)
-            movie_scores.append((movie_id, avg_rating, len(ratings)))
+        movie_scores = list(zip(stats.index, stats['mean'], stats['count']))
         
         # Sort by score
         movie_scores.sort(key=lambda x: (x[1], x[2]), reverse=True)
@@ -267,8 +269,8 @@ class AdvancedRecommendationService:
         """Item-based collaborative filtering"""
         # Get user's rated movies
         user_ratings = self.db.query(Rating).filter(
-            Rating.user_id == user_id
-        ).order_by(Rating.rating.desc()).limit(10).all()
+            Rating.user_pk == user_pk(user_id)
+        ).options(selectinload(Rating.movie)).order_by(Rating.rating.desc()).limit(10).all()
         
         if not user_ratings:
             return []
@@ -412,8 +414,8 @@ class AdvancedRecommendationService:
         """
         Personalized recommendations dựa trên user profile và behavior
         """
-        # Get user profile
-        profile = self.db.query(UserProfile).filter(
+        # Get user profile (only genre_preferences is scored: index-only scan on idx_profile_user_covering)
+        profile = self.db.query(UserProfile.genre_preferences).filter(
             UserProfile.user_id == user_id
         ).first()
         
@@ -543,12 +545,12 @@ class AdvancedRecommendationService:
     
     def _get_watched_movies(self, user_id: str) -> set:
         """Get set of movies user has already watched"""
-        watched = self.db.query(WatchHistory.movie_id).filter(
-            WatchHistory.user_id == user_id
+        watched = self.db.query(Movie.movie_id).join(WatchHistory.movie).filter(
+            WatchHistory.user_pk == user_pk(user_id)
         ).all()
         
-        rated = self.db.query(Rating.movie_id).filter(
-            Rating.user_id == user_id
+        rated = self.db.query(Movie.movie_id).join(Rating.movie).filter(
+            Rating.user_pk == user_pk(user_id)
         ).all()
         
         return set([w[0] for w in watched] + [r[0] for r in rated])
@@ -0,0 +1,90 @@
+"""
+Tests for the shared numeric kernels used by recommendation models
+"""
+import numpy as np
+from models import _kernels
+from models._kernels import topk_scores
+
+
+def test_topk_matches_full_sort():
+    """Top-k indices equal the head of a stable descending sort"""
+    rng = np.random.default_rng(0)
+    scores = rng.random(500).astype(np.float32)
+    expected = np.argsort(-scores, kind='stable')[:10]
+    assert list(topk_scores(scores, 10)) == list(expected)
+
+
+def test_topk_ties_and_nan():
+    """Ties keep the lower index first, NaN ranks last"""
+    scores = np.array([1.0, np.nan, 3.0, 3.0, 2.0], dtype=np.float32)
+    assert list(topk_scores(scores, 5)) == [2, 3, 4, 0, 1]
+
+
+def test_topk_ties_at_the_cut(monkeypatch):
+    """With many equal scores, every k gives the head of the stable sort (kernel and fallback)"""
+    rng = np.random.default_rng(2)
+    scores = rng.integers(0, 4, 200).astype(np.float32)
+    expected = np.argsort(-scores, kind='stable')
+    for k in (1, 5, 17, 60, 200):
+        assert list(topk_scores(scores, k)) == list(expected[:k])
+    monkeypatch.setattr(_kernels, 'NUMBA_AVAILABLE', False)
+    for k in (1, 5, 17, 60, 200):
+        assert list(topk_scores(scores, k)) == list(expected[:k])
+
+
+def test_topk_k_larger_than_input():
+    """k is clamped to the number of scores"""
+    assert list(topk_scores([0.5, 0.7], 10)) == [1, 0]
+    assert len(topk_scores([], 3)) == 0
+
+
+def test_topk_numpy_fallback(monkeypatch):
+    """NumPy fallback gives the same ranking as the numba kernel"""
+    scores = np.array([0.2, 0.9, 0.9, 0.1, 0.5], dtype=np.float32)
+    expected = list(topk_scores(scores, 3))
+    monkeypatch.setattr(_kernels, 'NUMBA_AVAILABLE', False)
+    assert list(topk_scores(scores, 3)) == expected == [1, 2, 4]
+
+
+def test_cf_scores_matches_sparse_matvec():
+    """Parallel CF kernel equals (R.T @ sim) / sum|sim|"""
+    from scipy import sparse
+    from models._kernels import cf_scores
+    rng = np.random.default_rng(2)
+    R = sparse.random(30, 40, density=0.2, random_state=3, dtype=np.float32).tocsr()
+    sim = rng.standard_normal(30).astype(np.float32)
+    denom = np.abs(sim).sum()
+    np.testing.assert_allclose(cf_scores(R.tocsc(), sim, denom), (R.T @ sim) / denom, rtol=1e-5, atol=1e-6)
+
+
+def test_update_similarity_rows_matches_full_rebuild():
+    """Recomputing only the changed users' rows/columns equals a full Rn @ Rn.T"""
+    from scipy import sparse
+    from sklearn.preprocessing import normalize
+    from models._kernels import update_similarity_rows
+    R = sparse.random(25, 40, density=0.2, random_state=4, dtype=np.float32).tocsr()
+    Rn = normalize(R, norm='l2', axis=1)
+    S = (Rn @ Rn.T).tocsr()
+    R2 = R.tolil()
+    R2[[3, 7, 11]] = sparse.random(3, 40, density=0.3, random_state=5, dtype=np.float32).toarray()
+    Rn2 = normalize(R2.tocsr(), norm='l2', axis=1)
+    updated = update_similarity_rows(S, Rn2, [3, 7, 11])
+    np.testing.assert_allclose(updated.toarray(), (Rn2 @ Rn2.T).toarray(), rtol=1e-5, atol=1e-6)
+
+
+def test_context_scores_kernel_and_fallback(monkeypatch):
+    """Context scores add genre, recency, time-of-day, rating and decade bonuses; fallback agrees"""
+    from models._kernels import context_scores
+    args = (
+        np.array([[True, True], [False, True], [False, False]]),  # fav_match
+        [10, 2],  # fav_weights
+        np.array([True, False, False]),  # recent_match
+        np.array([False, True, False]),  # tod_match
+        np.array([8.5, 6.5, np.nan]),  # ratings
+        np.array([2012.0, np.nan, 1995.0]),  # years
+        2000,  # preferred_decade
+    )
+    expected = [0.15 + 0.06 + 0.2 + 0.15 + 0.15 + 0.1, 0.06 + 0.1 + 0.1 + 0.05, 0.1]
+    np.testing.assert_allclose(context_scores(*args), expected)
+    monkeypatch.setattr(_kernels, 'NUMBA_AVAILABLE', False)
+    np.testing.assert_allclose(context_scores(*args), expected)